@@ -0,0 +1,248 @@
+"""Cold-tier archival of completed donations.
+
+Completed donations older than a configurable horizon are moved out of the
+hot ``donations`` collection into compressed Parquet files, partitioned by
+month (``<archive_dir>/month=YYYY-MM/part-<uuid>.parquet``). Readers merge the
+archived tier back in so that timelines stay complete.
+
+User IDs are random UUIDs, so Parquet statistics cannot skip files for one
+user. The ``archive_parts`` collection therefore maps each user ID to the part
+files holding their donations, and a timeline read opens only those files.
+
+Run the job with ``python archive.py --horizon-days 365``; archives written
+before the part index existed are indexed with ``--index-parts``.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+import ids
+
+ROOT_DIR = Path(__file__).parent
+
+DEFAULT_ARCHIVE_DIR = ROOT_DIR / "archive" / "donations"
+DEFAULT_HORIZON_DAYS = 365
+DEFAULT_BATCH_SIZE = 5000
+
+# Payment audit fields included: the bank's own transaction ID (server.py) and a
+# txn_id moved aside as a duplicate (indexes.py). Part files written before a
+# column existed read it back as null.
+ARCHIVE_COLUMNS = [
+    "id", "user_id", "charity_id", "amount", "ripple_color", "ripple_size",
+    "status", "timestamp", "txn_id", "payment_timestamp", "bank_txn_id", "duplicate_txn_id",
+]
+
+logger = logging.getLogger(__name__)
+
+
+def archive_schema():
+    """Fixed Parquet schema so part files with all-null columns stay compatible"""
+    import pyarrow as pa
+
+    return pa.schema([
+        (col, pa.float64() if col in ("amount", "ripple_size") else pa.string())
+        for col in ARCHIVE_COLUMNS
+    ])
+
+
+def month_partition(timestamp: str) -> str:
+    """Return the ``YYYY-MM`` partition key for an ISO timestamp"""
+    return timestamp[:7]
+
+
+def write_partition(archive_dir: Path, month: str, rows: List[dict]) -> Path:
+    """Write one batch of donations as a new part file of a month partition"""
+    import pandas as pd
+
+    part_dir = Path(archive_dir) / f"month={month}"
+    part_dir.mkdir(parents=True, exist_ok=True)
+    path = part_dir / f"part-{uuid.uuid4().hex}.parquet"
+    # Dot-prefixed files are skipped by Parquet dataset discovery
+    tmp_path = part_dir / f".{path.name}.tmp"
+
+    # Grouped by user so row-group statistics can still skip within a file
+    rows = sorted(rows, key=lambda row: (row["user_id"], row["timestamp"]))
+    frame = pd.DataFrame([{col: row.get(col) for col in ARCHIVE_COLUMNS} for row in rows])
+    frame.to_parquet(tmp_path, engine="pyarrow", compression="zstd", index=False,
+                     schema=archive_schema())
+    # Only publish complete files so readers never see a partial partition
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_archived_donations(archive_dir: Path, user_id: Optional[str] = None,
+                            parts: Optional[Iterable[str]] = None) -> List[dict]:
+    """Read archived donations, optionally only those of one user.
+
+    ``parts`` limits the read to those part files (paths relative to
+    ``archive_dir``); by default every part file is scanned. Files are opened
+    with memory-mapped I/O and the user filter is pushed down to the row groups.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    archive_dir = Path(archive_dir)
+    if parts is None:
+        paths = sorted(archive_dir.glob("month=*/*.parquet"))
+    else:
+        paths = [archive_dir / part for part in parts if (archive_dir / part).exists()]
+    if not paths:
+        return []
+
+    dataset = ds.dataset(
+        [str(path) for path in paths],
+        schema=archive_schema(),
+        format="parquet",
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+    row_filter = ds.field("user_id") == user_id if user_id else None
+    return dataset.to_table(columns=ARCHIVE_COLUMNS, filter=row_filter).to_pylist()
+
+
+async def load_archived_donations(db, archive_dir: Path, user_id: Optional[str] = None) -> List[dict]:
+    """Read archived donations off the event loop, only opening the user's part files"""
+    parts = None
+    if user_id:
+        entry = await db.archive_parts.find_one({"_id": user_id})
+        if not entry:
+            return []
+        parts = entry["parts"]
+    return await asyncio.to_thread(read_archived_donations, archive_dir, user_id, parts)
+
+
+async def record_parts(db, parts: Dict[str, Iterable[str]]):
+    """Add part files (relative paths) to each user's entry in the part index"""
+    if not parts:
+        return
+    await db.archive_parts.bulk_write([
+        UpdateOne({"_id": user_id}, {"$addToSet": {"parts": {"$each": sorted(paths)}}}, upsert=True)
+        for user_id, paths in parts.items()
+    ], ordered=False)
+
+
+def _parts_by_user(archive_dir: Path) -> Dict[str, set]:
+    import pyarrow.parquet as pq
+
+    archive_dir = Path(archive_dir)
+    parts: Dict[str, set] = {}
+    for path in sorted(archive_dir.glob("month=*/*.parquet")):
+        part = path.relative_to(archive_dir).as_posix()
+        for user_id in set(pq.read_table(path, columns=["user_id"]).column("user_id").to_pylist()):
+            parts.setdefault(user_id, set()).add(part)
+    return parts
+
+
+async def index_parts(db, archive_dir: Path = DEFAULT_ARCHIVE_DIR) -> int:
+    """Rebuild the part index from the files on disk; returns the number of users"""
+    parts = await asyncio.to_thread(_parts_by_user, archive_dir)
+    await record_parts(db, parts)
+    return len(parts)
+
+
+async def archive_donations(
+    db,
+    archive_dir: Path = DEFAULT_ARCHIVE_DIR,
+    horizon_days: int = DEFAULT_HORIZON_DAYS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Dict[str, int]:
+    """Move completed donations older than ``horizon_days`` to the cold tier.
+
+    Each batch is written to Parquet before it is deleted from Mongo. A crash
+    in between leaves the batch in both tiers, and the next run archives it
+    again into new part files; ``merge_tiers`` drops those repeats by donation id.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=horizon_days)).isoformat()
+    stats = {"archived": 0, "files": 0}
+
+    while True:
+        donations = await db.donations.find(
+            # Donations with undrained side effects stay hot until outbox.py is done
+            {"status": "completed", "timestamp": {"$lt": cutoff}, "outbox": {"$exists": False}}
+        ).sort("timestamp", 1).limit(batch_size).to_list(batch_size)
+        donations = [ids.to_api(d) for d in donations]
+        if not donations:
+            break
+
+        by_month: Dict[str, List[dict]] = {}
+        for donation in donations:
+            by_month.setdefault(month_partition(donation["timestamp"]), []).append(donation)
+
+        parts: Dict[str, set] = {}
+        for month, rows in by_month.items():
+            path = await asyncio.to_thread(write_partition, archive_dir, month, rows)
+            logger.info(f"Archived {len(rows)} donations to {path}")
+            stats["files"] += 1
+            part = path.relative_to(Path(archive_dir)).as_posix()
+            for row in rows:
+                parts.setdefault(row["user_id"], set()).add(part)
+
+        # Indexed before the hot rows go, so a reader always finds one of the two
+        await record_parts(db, parts)
+        await db.donations.delete_many(ids.ids_filter(d["id"] for d in donations))
+        stats["archived"] += len(donations)
+
+    return stats
+
+
+def merge_tiers(hot: List[dict], archived: List[dict], limit: Optional[int] = None) -> List[dict]:
+    """Merge hot and archived donations newest first, preferring the hot copy.
+
+    A donation archived twice (see ``archive_donations``) is kept once.
+    """
+    seen = {donation["id"] for donation in hot}
+    merged = list(hot)
+    for donation in archived:
+        if donation["id"] not in seen:
+            seen.add(donation["id"])
+            merged.append(donation)
+    merged.sort(key=lambda donation: donation["timestamp"], reverse=True)
+    return merged[:limit] if limit else merged
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(ROOT_DIR / '.env')
+    logging.basicConfig(level=logging.INFO)
+    ids.configure_from_env()
+
+    parser = argparse.ArgumentParser(description="Archive old completed donations to Parquet")
+    parser.add_argument("--horizon-days", type=int,
+                        default=int(os.environ.get("ARCHIVE_HORIZON_DAYS", DEFAULT_HORIZON_DAYS)))
+    parser.add_argument("--archive-dir", type=Path,
+                        default=Path(os.environ.get("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)))
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--index-parts", action="store_true",
+                        help="Only rebuild the per-user index of existing part files")
+    args = parser.parse_args()
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            if args.index_parts:
+                count = await index_parts(client[os.environ['DB_NAME']], args.archive_dir)
+                logger.info(f"Indexed archive part files for {count} users")
+                return
+            stats = await archive_donations(
+                client[os.environ['DB_NAME']],
+                archive_dir=args.archive_dir,
+                horizon_days=args.horizon_days,
+                batch_size=args.batch_size,
+            )
+            logger.info(f"Archived {stats['archived']} donations into {stats['files']} files")
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Client for the bank verification server (backend/server.js).
+
+A single pooled ``httpx.AsyncClient`` is opened by the app lifespan and kept
+alive for the life of the process (HTTP/2 when the ``h2`` package is
+installed), so payments reuse warm connections instead of paying a new
+TCP/TLS handshake each. Concurrent verification checks are merged into bulk
+``POST /api/transactions/lookup`` calls, and a circuit breaker fails fast
+while the bank is unhealthy.
+"""
+import asyncio
+import importlib.util
+import logging
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BankUnavailableError(Exception):
+    """The bank could not be reached or answered with an error"""
+
+
+class CircuitOpenError(BankUnavailableError):
+    """Calls are short-circuited until the bank has had time to recover"""
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures; after
+    ``reset_timeout`` seconds one trial call is let through (half-open)."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class BankClient:
+    """Pooled, micro-batching client for payment verification checks"""
+
+    def __init__(self, base_url: str, timeout: float = 2.0, batch_window: float = 0.005,
+                 max_batch: int = 100, max_connections: int = 20,
+                 breaker: Optional[CircuitBreaker] = None, transport=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_connections = max_connections
+        self.breaker = breaker or CircuitBreaker()
+        self._transport = transport
+        self._http = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+
+    async def start(self):
+        import httpx
+
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=60.0,
+            ),
+            timeout=self.timeout,
+            transport=self._transport,
+        )
+
+    async def close(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._http:
+            await self._http.aclose()
+
+    async def find_transaction(self, order_id: str) -> Optional[dict]:
+        """Return the bank's successful transaction for ``order_id``, if any.
+
+        Concurrent callers are merged into one bulk lookup; callers asking
+        about the same order share a single result.
+        """
+        future = self._pending.get(order_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[order_id] = future
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self._flush)
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if not batch:
+            return
+        task = asyncio.create_task(self._lookup(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _lookup(self, batch: Dict[str, asyncio.Future]):
+        try:
+            transactions = await self._request(list(batch))
+            by_order = {txn["orderId"]: txn for txn in transactions if txn.get("status") == "SUCCESS"}
+        except Exception as e:
+            # Every waiting caller must be answered, whatever went wrong
+            error = e if isinstance(e, BankUnavailableError) else BankUnavailableError(repr(e))
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for order_id, future in batch.items():
+            if not future.done():
+                future.set_result(by_order.get(order_id))
+
+    async def _request(self, order_ids: List[str]) -> List[dict]:
+        if not self.breaker.allow():
+            raise CircuitOpenError("Bank circuit is open")
+        try:
+            response = await self._http.post(
+                "/api/transactions/lookup", json={"order_ids": order_ids}, timeout=self.timeout
+            )
+            response.raise_for_status()
+            transactions = parse_transactions(response.json())
+        except Exception as e:
+            # Also resets a half-open breaker's trial, so the circuit can close again
+            self.breaker.record_failure()
+            logger.error(f"Bank lookup of {len(order_ids)} orders failed: {e!r}")
+            raise BankUnavailableError(str(e)) from e
+        self.breaker.record_success()
+        return transactions
+
+
+def parse_transactions(body) -> List[dict]:
+    """The transactions of a lookup response; raises ValueError when malformed"""
+    transactions = body.get("transactions") if isinstance(body, dict) else None
+    if not isinstance(transactions, list) or not all(
+        isinstance(txn, dict) and isinstance(txn.get("orderId"), str) for txn in transactions
+    ):
+        raise ValueError(f"Malformed bank lookup response: {str(body)[:200]}")
+    return transactions
@@ -0,0 +1,240 @@
+"""Opt-in request profiling and event-loop lag monitoring.
+
+Neither tool is installed unless configured, so both cost nothing when
+disabled:
+
+- ``ProfilingMiddleware`` (``PROFILE_DIR``) profiles a request when it carries
+  an ``X-Profile: cprofile`` or ``X-Profile: sample`` header together with
+  ``X-Profile-Token: <PROFILE_SECRET>``, or when it is picked by
+  ``PROFILE_SAMPLE_RATE``. Without a secret the header is ignored. At most
+  ``PROFILE_MAX_CONCURRENT`` requests are profiled at once and
+  ``PROFILE_MAX_FILES`` per process. cProfile runs are written as ``.pstats``
+  files, stack-sampled runs as ``.folded`` collapsed stacks that
+  flamegraph.pl and speedscope read directly; files are written off the loop.
+- ``LoopLagMonitor`` (``LOOP_LAG_THRESHOLD_MS``) logs the task and stack that
+  held the event loop whenever it stalls for longer than the threshold.
+
+Both observe the event loop thread as a whole: while a request is being
+profiled, any other request interleaved on the loop is captured as well.
+"""
+import asyncio
+import cProfile
+import hmac
+import logging
+import random
+import re
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_TOKEN_HEADER = b"x-profile-token"
+PROFILE_MODES = ("cprofile", "sample")
+
+
+def collapse_stack(frame) -> str:
+    """Render a frame and its callers as one root-first collapsed stack line"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stack of one thread at a fixed interval from a helper thread"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles selected requests into ``profile_dir``"""
+
+    def __init__(self, app, profile_dir: Path, sample_rate: float = 0.0,
+                 default_mode: str = "sample", secret: Optional[str] = None,
+                 max_concurrent: int = 2, max_profiles: int = 1000):
+        self.app = app
+        self.profile_dir = Path(profile_dir)
+        self.sample_rate = sample_rate
+        self.default_mode = default_mode
+        self.secret = secret
+        self.max_concurrent = max_concurrent
+        self.max_profiles = max_profiles
+        self.active = 0
+        self.written = 0
+        # cProfile cannot run two profilers on one thread at once
+        self._cprofile_busy = False
+        self._limit_reported = False
+
+    def _authorized(self, token: Optional[bytes]) -> bool:
+        return bool(self.secret and token) and hmac.compare_digest(token, self.secret.encode())
+
+    def _requested_mode(self, scope) -> Optional[str]:
+        headers = dict(scope.get("headers", []))
+        mode = headers.get(PROFILE_HEADER, b"").decode("latin-1").strip().lower()
+        if mode in PROFILE_MODES and self._authorized(headers.get(PROFILE_TOKEN_HEADER)):
+            return mode
+        if self.sample_rate and random.random() < self.sample_rate:
+            return self.default_mode
+        return None
+
+    def _has_capacity(self) -> bool:
+        if self.written + self.active >= self.max_profiles:
+            if not self._limit_reported:
+                self._limit_reported = True
+                logger.warning(f"Profile limit of {self.max_profiles} files reached; no more profiles are taken")
+            return False
+        return self.active < self.max_concurrent
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        mode = self._requested_mode(scope)
+        if mode == "cprofile" and self._cprofile_busy:
+            mode = None
+        if mode is None or not self._has_capacity():
+            return await self.app(scope, receive, send)
+
+        self.active += 1
+        try:
+            if mode == "cprofile":
+                await self._run_cprofile(scope, receive, send)
+            else:
+                await self._run_sampled(scope, receive, send)
+        finally:
+            self.active -= 1
+            self.written += 1
+
+    def _output_path(self, scope, suffix: str) -> Path:
+        route = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-") or "root"
+        stamp = time.strftime("%Y%m%dT%H%M%S")
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        return self.profile_dir / f"{stamp}-{scope['method']}-{route}-{uuid.uuid4().hex[:8]}{suffix}"
+
+    async def _write(self, scope, suffix: str, dump) -> Path:
+        """Write a profile from a worker thread, so large files do not stall the loop"""
+        def write():
+            path = self._output_path(scope, suffix)
+            dump(path)
+            return path
+        return await asyncio.to_thread(write)
+
+    async def _run_cprofile(self, scope, receive, send):
+        profiler = cProfile.Profile()
+        self._cprofile_busy = True
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.disable()
+            self._cprofile_busy = False
+            path = await self._write(scope, ".pstats", profiler.dump_stats)
+            logger.info(f"Wrote cProfile stats for {scope['path']} to {path}")
+
+    async def _run_sampled(self, scope, receive, send):
+        sampler = StackSampler(threading.get_ident())
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            samples = sampler.stop()
+            path = await self._write(scope, ".folded", lambda path: path.write_text(
+                "".join(f"{stack} {count}\n" for stack, count in samples.items())
+            ))
+            logger.info(f"Wrote {sum(samples.values())} stack samples for {scope['path']} to {path}")
+
+
+class LoopLagMonitor:
+    """Watchdog reporting which coroutine blocked the event loop.
+
+    A heartbeat task stamps the time on every loop iteration it gets; a
+    watchdog thread notices when the stamp goes stale and captures the loop
+    thread's current task and stack while the stall is still in progress.
+    """
+
+    def __init__(self, threshold_ms: float, interval_ms: Optional[float] = None):
+        self.threshold = threshold_ms / 1000
+        self.interval = (interval_ms or max(1.0, threshold_ms / 4)) / 1000
+        self.stalls = 0
+        self._beat = time.perf_counter()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._heartbeat = asyncio.create_task(self._run_heartbeat(), name="loop-lag-heartbeat")
+        self._watchdog = threading.Thread(target=self._run_watchdog, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+        if self._watchdog:
+            self._watchdog.join()
+
+    async def _run_heartbeat(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._beat = now
+            lag = now - expected
+            if lag > self.threshold:
+                logger.warning(f"Event loop stalled for {lag * 1000:.0f} ms")
+
+    def _run_watchdog(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if time.perf_counter() - beat <= self.threshold or beat == reported_beat:
+                continue
+            # Report each stall once, while the blocking code is still on the stack
+            reported_beat = beat
+            self.stalls += 1
+            self._report_stall()
+
+    def _report_stall(self):
+        task = asyncio.current_task(self._loop)
+        frame = sys._current_frames().get(self._loop_thread_id)
+        coro = getattr(task.get_coro(), "__qualname__", repr(task.get_coro())) if task else None
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        logger.warning(
+            f"Event loop blocked for more than {self.threshold * 1000:.0f} ms "
+            f"in task {task.get_name() if task else None} ({coro})\n{stack}"
+        )
@@ -0,0 +1,89 @@
+"""Document identity: the model UUID is stored as ``_id``.
+
+Users, donations, charities and audio messages keep their UUID in ``_id``
+instead of a separate ``id`` field next to an ObjectId, so every lookup uses
+the built-in ``_id`` index. With ``UUID_BINARY=1`` the UUID is stored as a
+16-byte BSON Binary (subtype 4) rather than a 36-character string.
+
+The API keeps exposing ``id``: ``to_api`` maps ``_id`` back before a document
+leaves the database layer. While ``migrate_ids.py`` runs against a live
+deployment, ``ID_LEGACY_FALLBACK=1`` makes lookups also match documents that
+still carry an ObjectId ``_id`` and a string ``id``.
+"""
+import os
+import uuid
+from typing import Iterable, Optional
+
+from bson import Binary, ObjectId
+from bson.binary import UUID_SUBTYPE
+
+_binary = False
+_legacy_fallback = False
+
+
+def configure(binary: bool = False, legacy_fallback: bool = False):
+    """Set the storage format; called once from the app lifespan or a tool"""
+    global _binary, _legacy_fallback
+    _binary = binary
+    _legacy_fallback = legacy_fallback
+
+
+def configure_from_env():
+    """``configure`` from ``UUID_BINARY`` and ``ID_LEGACY_FALLBACK``, for the CLI tools"""
+    configure(
+        binary=os.environ.get('UUID_BINARY', '0') == '1',
+        legacy_fallback=os.environ.get('ID_LEGACY_FALLBACK', '0') == '1',
+    )
+
+
+def to_db(value: str):
+    """Stored ``_id`` for an API ID; non-UUID strings are kept as they are"""
+    if not _binary:
+        return value
+    try:
+        return Binary.from_uuid(uuid.UUID(value))
+    except (ValueError, TypeError, AttributeError):
+        return value
+
+
+def from_db(value) -> Optional[str]:
+    """API ID for a stored ``_id``"""
+    if isinstance(value, Binary) and value.subtype == UUID_SUBTYPE:
+        return str(value.as_uuid())
+    if isinstance(value, (uuid.UUID, ObjectId)):
+        return str(value)
+    return value
+
+
+def id_filter(value: str) -> dict:
+    """Filter matching the document with API ID ``value``"""
+    if _legacy_fallback:
+        return {"$or": [{"_id": to_db(value)}, {"id": value}]}
+    return {"_id": to_db(value)}
+
+
+def ids_filter(values: Iterable[str]) -> dict:
+    """Filter matching every document whose API ID is in ``values``"""
+    values = list(values)
+    stored = {"_id": {"$in": [to_db(value) for value in values]}}
+    if _legacy_fallback:
+        return {"$or": [stored, {"id": {"$in": values}}]}
+    return stored
+
+
+def to_document(data: dict) -> dict:
+    """Turn a dumped model into a document, moving ``id`` into ``_id``"""
+    doc = dict(data)
+    doc["_id"] = to_db(doc.pop("id"))
+    return doc
+
+
+def to_api(doc: Optional[dict]) -> Optional[dict]:
+    """Expose a stored document with its ``id`` field, as the API always has"""
+    if doc is None:
+        return None
+    if "_id" in doc:
+        stored_id = doc.pop("_id")
+        # Legacy documents already carry their UUID in ``id``
+        doc.setdefault("id", from_db(stored_id))
+    return doc
@@ -0,0 +1,200 @@
+"""Per-user impact summaries.
+
+One ``user_impact`` document per donor holds their giving totals, per-charity
+totals and counts, first and last donation and their daily giving streak. The
+outbox worker creates the summary if needed, then folds each verified
+donation into it with a single atomic update; ``python impact.py`` rebuilds
+summaries from the full donation history (hot and archived tiers).
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+
+import ids
+from archive import DEFAULT_ARCHIVE_DIR, load_archived_donations, merge_tiers
+
+ROOT_DIR = Path(__file__).parent
+
+# How many applied outbox keys each summary remembers for de-duplication
+APPLIED_KEYS_KEPT = 200
+
+logger = logging.getLogger(__name__)
+
+
+def donation_day(timestamp: str) -> str:
+    """UTC calendar day of an ISO timestamp"""
+    return timestamp[:10]
+
+
+def previous_day(day: str) -> str:
+    return (date.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+
+def current_streak(summary: dict, today: Optional[str] = None) -> int:
+    """Streak still alive today, i.e. the last donation was today or yesterday"""
+    last_day = summary.get("last_donation_day")
+    if not last_day:
+        return 0
+    today = today or datetime.now(timezone.utc).date().isoformat()
+    return summary.get("streak_days", 0) if last_day >= previous_day(today) else 0
+
+
+def impact_summary_init(user_id: str) -> UpdateOne:
+    """Create an empty summary for a new donor; a no-op once it exists.
+
+    The filter is an equality on the unique ``user_id`` key alone, so when two
+    workers create the same summary the losing upsert is retried as an update
+    (or fails with a duplicate key error that callers can ignore).
+    """
+    return UpdateOne(
+        {"user_id": user_id},
+        {"$setOnInsert": {"total_amount": 0.0, "donation_count": 0, "per_charity": {}, "outbox_keys": []}},
+        upsert=True,
+    )
+
+
+def impact_update(donation: dict, key: str) -> UpdateOne:
+    """Atomic update folding one completed donation into its donor's summary.
+
+    Run it after ``impact_summary_init``. The filter skips summaries that
+    already applied ``key``, so a repeated update matches nothing.
+    """
+    amount = donation["amount"]
+    timestamp = donation["timestamp"]
+    day = donation_day(timestamp)
+    # Client-supplied, so keep it from being read as a field path
+    charity_id = {"$literal": donation["charity_id"]}
+
+    per_charity = {"$objectToArray": {"$ifNull": ["$per_charity", {}]}}
+    current = {"$arrayElemAt": [
+        {"$filter": {"input": per_charity, "cond": {"$eq": ["$$this.k", charity_id]}}}, 0
+    ]}
+    others = {"$filter": {"input": per_charity, "cond": {"$ne": ["$$this.k", charity_id]}}}
+
+    return UpdateOne(
+        {"user_id": donation["user_id"], "outbox_keys": {"$ne": key}},
+        [{"$set": {
+            "total_amount": {"$add": [{"$ifNull": ["$total_amount", 0]}, amount]},
+            "donation_count": {"$add": [{"$ifNull": ["$donation_count", 0]}, 1]},
+            "per_charity": {"$arrayToObject": {"$concatArrays": [others, [{
+                "k": charity_id,
+                "v": {
+                    "amount": {"$add": [{"$ifNull": [{"$let": {"vars": {"c": current}, "in": "$$c.v.amount"}}, 0]}, amount]},
+                    "count": {"$add": [{"$ifNull": [{"$let": {"vars": {"c": current}, "in": "$$c.v.count"}}, 0]}, 1]},
+                },
+            }]]}},
+            "first_donation_at": {"$min": ["$first_donation_at", timestamp]},
+            "last_donation_at": {"$max": ["$last_donation_at", timestamp]},
+            "last_donation_day": {"$max": ["$last_donation_day", day]},
+            # Every expression sees the document as it was before this update
+            "streak_days": {"$switch": {
+                "branches": [
+                    {"case": {"$gte": [{"$ifNull": ["$last_donation_day", ""]}, day]},
+                     "then": "$streak_days"},
+                    {"case": {"$eq": ["$last_donation_day", previous_day(day)]},
+                     "then": {"$add": ["$streak_days", 1]}},
+                ],
+                "default": 1,
+            }},
+            "outbox_keys": {"$slice": [
+                {"$concatArrays": [{"$ifNull": ["$outbox_keys", []]}, [key]]}, -APPLIED_KEYS_KEPT
+            ]},
+        }}],
+    )
+
+
+def summarize(user_id: str, donations: Iterable[dict]) -> dict:
+    """Build a summary document from a user's completed donations"""
+    summary = {
+        "user_id": user_id,
+        "total_amount": 0.0,
+        "donation_count": 0,
+        "per_charity": {},
+        "first_donation_at": None,
+        "last_donation_at": None,
+        "last_donation_day": None,
+        "streak_days": 0,
+        "outbox_keys": [],
+    }
+    for donation in sorted(donations, key=lambda d: d["timestamp"]):
+        day = donation_day(donation["timestamp"])
+        charity = summary["per_charity"].setdefault(donation["charity_id"], {"amount": 0.0, "count": 0})
+        charity["amount"] += donation["amount"]
+        charity["count"] += 1
+        summary["total_amount"] += donation["amount"]
+        summary["donation_count"] += 1
+        summary["first_donation_at"] = summary["first_donation_at"] or donation["timestamp"]
+        summary["last_donation_at"] = donation["timestamp"]
+
+        last_day = summary["last_donation_day"]
+        if last_day != day:
+            summary["streak_days"] = summary["streak_days"] + 1 if last_day == previous_day(day) else 1
+        summary["last_donation_day"] = day
+
+        # Undrained outbox records are already counted here; mark them applied
+        if donation.get("outbox"):
+            summary["outbox_keys"].append(donation["outbox"]["key"])
+    return summary
+
+
+async def rebuild_user_impact(db, archive_dir: Path = DEFAULT_ARCHIVE_DIR,
+                              user_id: Optional[str] = None) -> int:
+    """Regenerate summaries from donation history; returns how many were written.
+
+    Run it while traffic is quiet: a donation verified between the history
+    read and the summary write is not included.
+    """
+    query = {"status": "completed"}
+    if user_id:
+        query["user_id"] = user_id
+    hot = await db.donations.find(
+        query,
+        {"id": 1, "user_id": 1, "charity_id": 1, "amount": 1, "timestamp": 1, "outbox.key": 1}
+    ).to_list(None)
+    hot = [ids.to_api(d) for d in hot]
+    archived = await load_archived_donations(db, archive_dir, user_id)
+
+    by_user: Dict[str, List[dict]] = {}
+    for donation in merge_tiers(hot, archived):
+        by_user.setdefault(donation["user_id"], []).append(donation)
+    if user_id:
+        by_user.setdefault(user_id, [])
+
+    for uid, donations in by_user.items():
+        await db.user_impact.replace_one({"user_id": uid}, summarize(uid, donations), upsert=True)
+    return len(by_user)
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(ROOT_DIR / '.env')
+    logging.basicConfig(level=logging.INFO)
+    ids.configure_from_env()
+
+    parser = argparse.ArgumentParser(description="Rebuild per-user impact summaries from donation history")
+    parser.add_argument("--user-id", help="Only rebuild this user's summary")
+    parser.add_argument("--archive-dir", type=Path,
+                        default=Path(os.environ.get("ARCHIVE_DIR", DEFAULT_ARCHIVE_DIR)))
+    args = parser.parse_args()
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            count = await rebuild_user_impact(client[os.environ['DB_NAME']], args.archive_dir, args.user_id)
+            logger.info(f"Rebuilt {count} impact summaries")
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Index definitions for every query issued by the backend.
+
+``ensure_indexes`` runs in the app lifespan; ``tests/test_query_plans.py``
+builds the same indexes and asserts that each route query uses them.
+
+Older writers could store the same ``txn_id`` on several donations, which
+would fail the unique ``txn_id_1`` build and with it startup. Before that
+index is first built, each ``txn_id`` is kept on its earliest donation and
+moved to ``duplicate_txn_id`` on the others, for review.
+"""
+import asyncio
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+TXN_ID_INDEX = "txn_id_1"
+
+logger = logging.getLogger(__name__)
+
+# Lookups by ID use the built-in _id index (see ids.py). The legacy id_1 indexes
+# are left alone here and dropped by migrate_ids.py once every document is migrated.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        # Not unique: register de-duplicates by lookup, and older data may hold repeats
+        IndexModel([("email", ASCENDING)], name="email_1"),
+    ],
+    "donations": [
+        # A payment can complete at most one donation; authoritative replay check
+        IndexModel(
+            [("txn_id", ASCENDING)], name=TXN_ID_INDEX, unique=True,
+            partialFilterExpression={"txn_id": {"$type": "string"}},
+        ),
+        # Ripple feed, leaderboard $match and the archive job
+        IndexModel([("status", ASCENDING), ("timestamp", DESCENDING)], name="status_1_timestamp_-1"),
+        # User timeline
+        IndexModel(
+            [("user_id", ASCENDING), ("status", ASCENDING), ("timestamp", DESCENDING)],
+            name="user_id_1_status_1_timestamp_-1",
+        ),
+        # Outbox claims; sparse because drained records are unset
+        IndexModel(
+            [("outbox.state", ASCENDING), ("outbox.available_at", ASCENDING)],
+            name="outbox_state_1_available_at_1", sparse=True,
+        ),
+    ],
+    "user_impact": [
+        # Unique: impact_summary_init's upsert relies on it when two first donations race
+        IndexModel([("user_id", ASCENDING)], name="user_id_1", unique=True),
+    ],
+    "audio_messages": [
+        # Presence lookups are covered: they only project donation_id and duration
+        IndexModel([("donation_id", ASCENDING), ("duration", ASCENDING)], name="donation_id_1_duration_1"),
+    ],
+}
+
+
+async def resolve_duplicate_txn_ids(db) -> int:
+    """Keep each ``txn_id`` on its earliest donation only; returns how many were moved"""
+    pipeline = [
+        {"$match": {"txn_id": {"$type": "string"}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {"_id": "$txn_id", "donations": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    moved = 0
+    async for group in db.donations.aggregate(pipeline, allowDiskUse=True):
+        duplicates = group["donations"][1:]
+        logger.warning(f"txn_id {group['_id']} is shared by {group['count']} donations; "
+                       f"moving it to duplicate_txn_id on {duplicates}")
+        result = await db.donations.update_many(
+            {"_id": {"$in": duplicates}, "txn_id": group["_id"]},
+            {"$rename": {"txn_id": "duplicate_txn_id"}},
+        )
+        moved += result.modified_count
+    return moved
+
+
+async def ensure_indexes(db):
+    """Create any missing indexes; a no-op when they already exist"""
+    # Only needed once: the built index rejects new duplicates
+    if TXN_ID_INDEX not in await db.donations.index_information():
+        await resolve_duplicate_txn_ids(db)
+    await asyncio.gather(*(
+        db[collection].create_indexes(models) for collection, models in INDEXES.items()
+    ))
@@ -0,0 +1,240 @@
+"""Online migration of documents to UUID ``_id`` keys.
+
+Documents written before ``ids.py`` carry an ObjectId ``_id`` next to their
+UUID in ``id``. This job moves them batch by batch: each batch is re-inserted
+under its UUID ``_id`` (a string, or a BSON Binary with ``UUID_BINARY=1``)
+without the ``id`` field, and the originals are deleted. On a replica set each
+batch runs in a transaction that deletes the originals before inserting the
+copies, so a concurrent write to a document being moved makes the batch retry
+instead of being lost; on a standalone server stop the API and outbox workers
+first.
+
+A copy and its original cannot both hold a uniquely indexed value such as
+``donations.txn_id``. Without a transaction, copies are written with those
+fields under a ``migrating_`` name, and only originals whose copy is confirmed
+written are deleted before the fields are renamed back. A run that stops
+part way can simply be started again.
+
+Serve traffic with ``ID_LEGACY_FALLBACK=1`` while the job runs. Once it is
+done and the fallback is switched off again, drop the now unused ``id_1``
+indexes with ``--drop-legacy-indexes``. Only ObjectId-keyed documents are
+moved, so choose ``UUID_BINARY`` before the first run.
+
+Run the job with ``python migrate_ids.py``. Data and index sizes are reported
+before and after; WiredTiger only returns freed file space (``storageSize``)
+to the OS after ``compact``.
+"""
+import argparse
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from pymongo.errors import BulkWriteError, OperationFailure
+
+import ids
+from outbox import DUPLICATE_KEY_ERROR
+
+ROOT_DIR = Path(__file__).parent
+
+MIGRATED_COLLECTIONS = ("users", "charities", "donations", "audio_messages")
+DEFAULT_BATCH_SIZE = 500
+# Voice notes are up to ~2 MB each; keep their transactions small
+BATCH_SIZES = {"audio_messages": 20}
+
+LEGACY_QUERY = {"_id": {"$type": "objectId"}, "id": {"$type": "string"}}
+LEGACY_INDEX = "id_1"
+INDEX_NOT_FOUND = 27
+# Fields with a unique index besides _id (see indexes.py)
+UNIQUE_FIELDS = {"donations": ("txn_id",)}
+STAGING_PREFIX = "migrating_"
+
+logger = logging.getLogger(__name__)
+
+
+def migrated(doc: dict) -> dict:
+    """The same document keyed by its UUID"""
+    doc = dict(doc)
+    doc.pop("_id")
+    return ids.to_document(doc)
+
+
+async def collection_sizes(db, name: str) -> Dict[str, int]:
+    """Document count plus data, storage and index sizes in bytes"""
+    try:
+        stats = await db[name].aggregate([{"$collStats": {"storageStats": {}}}]).to_list(1)
+    except OperationFailure:
+        stats = []
+    storage = stats[0]["storageStats"] if stats else {}
+    sizes = {
+        "count": storage.get("count", 0),
+        "size": storage.get("size", 0),
+        "storage_size": storage.get("storageSize", 0),
+        "total_index_size": storage.get("totalIndexSize", 0),
+    }
+    for index, size in storage.get("indexSizes", {}).items():
+        sizes[f"index:{index}"] = size
+    return sizes
+
+
+def staged(doc: dict, name: str) -> dict:
+    """A migrated copy with its unique fields moved out of their indexes"""
+    doc = dict(doc)
+    for field in UNIQUE_FIELDS.get(name, ()):
+        if field in doc:
+            doc[STAGING_PREFIX + field] = doc.pop(field)
+    return doc
+
+
+async def _unstage(collection, name: str, query: dict = None):
+    for field in UNIQUE_FIELDS.get(name, ()):
+        staging = STAGING_PREFIX + field
+        await collection.update_many(
+            {**(query or {}), staging: {"$exists": True}}, {"$rename": {staging: field}}
+        )
+
+
+async def _copy_confirmed(collection, name: str, docs: List[dict]) -> List[dict]:
+    """Write staged copies of ``docs``; returns the documents whose copy is stored"""
+    copies = [staged(migrated(doc), name) for doc in docs]
+    try:
+        await collection.insert_many(copies, ordered=False)
+        return docs
+    except BulkWriteError as e:
+        errors = {err["index"]: err for err in e.details.get("writeErrors", [])}
+
+    confirmed, failed = [], []
+    for index, (doc, copy) in enumerate(zip(docs, copies)):
+        error = errors.get(index)
+        if error and error.get("code") == DUPLICATE_KEY_ERROR and error.get("keyPattern") == {"_id": 1}:
+            # Left by a run that stopped before deleting the original, which stays authoritative
+            await collection.replace_one({"_id": copy["_id"]}, copy)
+        elif error:
+            failed.append(error)
+            continue
+        confirmed.append(doc)
+    for error in failed:
+        logger.error(f"Could not copy {name} document {docs[error['index']]['_id']}: {error.get('errmsg')}")
+    return confirmed
+
+
+async def _migrate_batch(db, name: str, batch_size: int, session=None) -> int:
+    collection = db[name]
+    docs = await collection.find(LEGACY_QUERY, session=session).limit(batch_size).to_list(batch_size)
+    if not docs:
+        return 0
+
+    if session:
+        # Deleting first frees the unique keys the copies take over
+        await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}}, session=session)
+        await collection.insert_many([migrated(doc) for doc in docs], session=session)
+        return len(docs)
+
+    confirmed = await _copy_confirmed(collection, name, docs)
+    await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in confirmed]}})
+    await _unstage(collection, name, {"_id": {"$in": [ids.to_db(doc["id"]) for doc in confirmed]}})
+    if len(confirmed) < len(docs):
+        raise RuntimeError(f"{len(docs) - len(confirmed)} {name} documents could not be migrated; "
+                           "their originals are kept")
+    return len(docs)
+
+
+async def _drop_legacy_index(db, name: str):
+    if await db[name].count_documents(LEGACY_QUERY, limit=1):
+        logger.warning(f"{name} still holds legacy documents; keeping {LEGACY_INDEX}")
+        return
+    try:
+        await db[name].drop_index(LEGACY_INDEX)
+        logger.info(f"Dropped {name}.{LEGACY_INDEX}")
+    except OperationFailure as e:
+        if e.code != INDEX_NOT_FOUND:
+            raise
+
+
+async def migrate_ids(
+    db,
+    collections: Iterable[str] = MIGRATED_COLLECTIONS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    drop_legacy_indexes: bool = False,
+) -> Dict[str, dict]:
+    """Move every legacy document to its UUID ``_id``; returns per-collection sizes"""
+    hello = await db.command("hello")
+    transactional = "setName" in hello or hello.get("msg") == "isdbgrid"
+    if not transactional:
+        logger.warning("Standalone server: batches are not transactional, stop writers before migrating")
+
+    report = {}
+    for name in collections:
+        size = min(batch_size, BATCH_SIZES.get(name, batch_size))
+        before = await collection_sizes(db, name)
+        moved = 0
+        while True:
+            if transactional:
+                async with await db.client.start_session() as session:
+                    count = await session.with_transaction(
+                        lambda s: _migrate_batch(db, name, size, s)
+                    )
+            else:
+                count = await _migrate_batch(db, name, size)
+            if not count:
+                break
+            moved += count
+            logger.info(f"Migrated {moved} {name}")
+        if not transactional:
+            # Copies whose original was deleted just before a previous run stopped
+            await _unstage(db[name], name)
+
+        if drop_legacy_indexes:
+            await _drop_legacy_index(db, name)
+        report[name] = {"migrated": moved, "before": before, "after": await collection_sizes(db, name)}
+    return report
+
+
+def format_report(report: Dict[str, dict]) -> str:
+    """One line per collection and size metric, with the relative change"""
+    lines = []
+    for name, result in report.items():
+        lines.append(f"{name}: {result['migrated']} documents migrated")
+        before, after = result["before"], result["after"]
+        for metric in sorted(set(before) | set(after)):
+            old, new = before.get(metric, 0), after.get(metric, 0)
+            change = f"{(new - old) / old:+.1%}" if old else "n/a"
+            lines.append(f"  {metric}: {old} -> {new} ({change})")
+    return "\n".join(lines)
+
+
+def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(ROOT_DIR / '.env')
+    logging.basicConfig(level=logging.INFO)
+    ids.configure_from_env()
+
+    parser = argparse.ArgumentParser(description="Move documents to UUID _id keys")
+    parser.add_argument("--collection", action="append", choices=MIGRATED_COLLECTIONS,
+                        help="Only migrate this collection (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--drop-legacy-indexes", action="store_true",
+                        help="Drop id_1 once a collection is fully migrated")
+    args = parser.parse_args()
+
+    async def run():
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            report = await migrate_ids(
+                client[os.environ['DB_NAME']],
+                collections=args.collection or MIGRATED_COLLECTIONS,
+                batch_size=args.batch_size,
+                drop_legacy_indexes=args.drop_legacy_indexes,
+            )
+            print(format_report(report))
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Outbox processing of post-payment side effects.
+
+``verify_payment`` completes a donation and embeds an ``outbox`` record in the
+same document with a single write. ``OutboxWorker`` drains those records in
+the background and applies the side effects:
+
+- the charity ``current_amount`` increment
+- the donor's ``hope_points`` increment
+- the donor's impact summary (see impact.py)
+- a feed notification
+
+A failed batch is retried with backoff. Each effect that succeeded is
+recorded on the outbox record (``outbox.applied``), so a retry only re-runs
+the effects that failed, however long it waits. The charity and user
+increments also remember their last ``APPLIED_KEYS_KEPT`` outbox keys, which
+covers a crash between an increment and the write recording it.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Set
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import ids
+from impact import impact_summary_init, impact_update
+
+logger = logging.getLogger(__name__)
+
+# How many applied keys each charity/user remembers for de-duplication
+APPLIED_KEYS_KEPT = 200
+EFFECTS = ("charity", "user", "impact", "notification")
+DUPLICATE_KEY_ERROR = 11000
+
+
+def new_outbox_record(donation_id: str, payment_id: str) -> dict:
+    """Outbox record stored on the donation alongside its status change"""
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "key": f"{donation_id}:{payment_id}",
+        "state": "pending",
+        "attempts": 0,
+        "available_at": now,
+        "created_at": now,
+    }
+
+
+def hope_points_for(amount: float) -> int:
+    """Hope points earned for a donation amount"""
+    return int(amount / 10)
+
+
+async def ignore_duplicates(write):
+    """Await a bulk write, tolerating duplicate key errors from already-applied keys"""
+    try:
+        await write
+    except BulkWriteError as e:
+        errors = [err for err in e.details.get("writeErrors", [])
+                  if err.get("code") != DUPLICATE_KEY_ERROR]
+        if errors:
+            raise
+
+
+class OutboxWorker:
+    """Pool of asyncio tasks draining donation outbox records in batches"""
+
+    def __init__(self, db, concurrency: int = 2, batch_size: int = 50,
+                 poll_interval: float = 1.0, lease_seconds: float = 30.0,
+                 max_attempts: int = 8):
+        self.db = db
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._run(), name=f"outbox-worker-{i}")
+            for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Wake idle workers after a new outbox record was written"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                batch = await self._claim_batch()
+                if batch:
+                    await self._process(batch)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}")
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim_batch(self) -> List[dict]:
+        """Lease up to ``batch_size`` due records, including expired leases.
+
+        Three round trips whatever the batch size: pick candidates, lease them
+        all with one ``update_many`` stamping a fresh lease token, then read
+        back the records carrying that token. A candidate another worker leased
+        in between no longer matches the update, so it is never claimed twice.
+        """
+        now = datetime.now(timezone.utc)
+        lease_until = (now + timedelta(seconds=self.lease_seconds)).isoformat()
+        # A processing record whose lease ran out is due again
+        due = {"outbox.state": {"$in": ["pending", "processing"]},
+               "outbox.available_at": {"$lte": now.isoformat()}}
+
+        candidates = await self.db.donations.find(due, {"_id": 1}).limit(self.batch_size).to_list(None)
+        if not candidates:
+            return []
+        lease = uuid.uuid4().hex
+        await self.db.donations.update_many(
+            {**due, "_id": {"$in": [d["_id"] for d in candidates]}},
+            {"$set": {"outbox.state": "processing", "outbox.available_at": lease_until,
+                      "outbox.lease": lease},
+             "$inc": {"outbox.attempts": 1}},
+        )
+        claimed = await self.db.donations.find(
+            {"outbox.state": "processing", "outbox.lease": lease}
+        ).to_list(None)
+        return [ids.to_api(d) for d in claimed]
+
+    async def _process(self, batch: List[dict]):
+        applied = await self._apply_effects(batch)
+        done = [d for d in batch if applied[d["outbox"]["key"]] >= set(EFFECTS)]
+        unfinished = [d for d in batch if applied[d["outbox"]["key"]] < set(EFFECTS)]
+
+        if done:
+            await self.db.donations.bulk_write([
+                UpdateOne({**ids.id_filter(d["id"]), "outbox.key": d["outbox"]["key"]}, {"$unset": {"outbox": ""}})
+                for d in done
+            ], ordered=False)
+        if unfinished:
+            await self._reschedule(unfinished, applied)
+
+    async def _apply_effects(self, batch: List[dict]) -> Dict[str, Set[str]]:
+        """Apply the effects each record has not applied yet; returns every
+        record's applied effects, keyed by outbox key"""
+        applied = {d["outbox"]["key"]: set(d["outbox"].get("applied", [])) for d in batch}
+
+        def guarded_inc(field: str, value: float, key: str) -> dict:
+            return {
+                "$inc": {field: value},
+                "$push": {"outbox_keys": {"$each": [key], "$slice": -APPLIED_KEYS_KEPT}},
+            }
+
+        def notification(d: dict) -> InsertOne:
+            return InsertOne({
+                "_id": d["outbox"]["key"],
+                "type": "donation_completed",
+                "donation_id": d["id"],
+                "user_id": d["user_id"],
+                "charity_id": d["charity_id"],
+                "amount": d["amount"],
+                "created_at": d.get("payment_timestamp") or d["outbox"]["created_at"],
+            })
+
+        async def fold_impact(ops: List[UpdateOne], ordered: bool):
+            # Created first with an equality-only upsert, so two first donations
+            # of a new donor cannot race each other into a duplicate key error
+            new_donors = sorted({d["user_id"] for d in batch if "impact" not in applied[d["outbox"]["key"]]})
+            await ignore_duplicates(self.db.user_impact.bulk_write(
+                [impact_summary_init(user_id) for user_id in new_donors], ordered=False
+            ))
+            await self.db.user_impact.bulk_write(ops, ordered=ordered)
+
+        effects = {
+            "charity": (self.db.charities.bulk_write, lambda d: UpdateOne(
+                {**ids.id_filter(d["charity_id"]), "outbox_keys": {"$ne": d["outbox"]["key"]}},
+                guarded_inc("current_amount", d["amount"], d["outbox"]["key"]))),
+            "user": (self.db.users.bulk_write, lambda d: UpdateOne(
+                {**ids.id_filter(d["user_id"]), "outbox_keys": {"$ne": d["outbox"]["key"]}},
+                guarded_inc("hope_points", hope_points_for(d["amount"]), d["outbox"]["key"]))),
+            "impact": (fold_impact, lambda d: impact_update(d, d["outbox"]["key"])),
+            "notification": (self.db.notifications.bulk_write, notification),
+        }
+        results = await asyncio.gather(*(
+            self._apply(effect, write, [
+                (d, build(d)) for d in batch if effect not in applied[d["outbox"]["key"]]
+            ])
+            for effect, (write, build) in effects.items()
+        ))
+        for effect, keys in zip(effects, results):
+            for key in keys:
+                applied[key].add(effect)
+        return applied
+
+    async def _apply(self, effect: str, write, ops: List[tuple]) -> Set[str]:
+        """Run one effect's bulk write; returns the outbox keys it is now applied for"""
+        if not ops:
+            return set()
+        try:
+            await write([op for _, op in ops], ordered=False)
+            failed = set()
+        except BulkWriteError as e:
+            # A duplicate key means the effect was applied by an earlier attempt
+            failed = {err["index"] for err in e.details.get("writeErrors", [])
+                      if err.get("code") != DUPLICATE_KEY_ERROR}
+        except Exception as e:
+            logger.error(f"Outbox {effect} writes failed: {e}")
+            failed = set(range(len(ops)))
+        if failed:
+            logger.error(f"Outbox {effect} failed for {len(failed)} of {len(ops)} records")
+        return {d["outbox"]["key"] for index, (d, _) in enumerate(ops) if index not in failed}
+
+    async def _reschedule(self, batch: List[dict], applied: Dict[str, Set[str]]):
+        for donation in batch:
+            outbox = donation["outbox"]
+            # Effects already applied are skipped on every later attempt
+            progress = {"outbox.applied": sorted(applied[outbox["key"]])}
+            if outbox["attempts"] >= self.max_attempts:
+                logger.error(f"Outbox record {outbox['key']} failed {outbox['attempts']} times")
+                update = {"$set": {**progress, "outbox.state": "failed"}}
+            else:
+                backoff = min(300, 2 ** outbox["attempts"])
+                retry_at = datetime.now(timezone.utc) + timedelta(seconds=backoff)
+                update = {"$set": {**progress, "outbox.state": "pending", "outbox.available_at": retry_at.isoformat()}}
+            await self.db.donations.update_one(
+                {**ids.id_filter(donation["id"]), "outbox.key": outbox["key"]}, update
+            )
@@ -0,0 +1,89 @@
+"""Fast-path detection of replayed payment verifications.
+
+``ReplayGuard`` keeps two in-memory structures per process:
+
+- an exact, bounded map of recently verified ``txn_id -> donation_id``, which
+  answers obvious replays (client retry storms) without touching Mongo;
+- a Bloom filter of every ``txn_id`` seen since startup, loaded from the
+  donations collection. A negative answer proves the payment is new, so the
+  replay lookup is skipped; a positive answer is confirmed against Mongo.
+
+The unique ``txn_id`` index and the conditional status update in
+``verify_payment`` remain the authoritative check, since each worker process
+has its own guard. Verified payments are never un-verified, so a Bloom
+filter is used rather than a deletable cuckoo filter.
+"""
+import hashlib
+import logging
+import math
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over one blake2b digest"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class ReplayGuard:
+    """Recent-exact plus Bloom-filtered memory of verified payments"""
+
+    def __init__(self, capacity: int = 100_000, recent_size: int = 10_000, error_rate: float = 0.001):
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.recent_size = recent_size
+        self._recent: "OrderedDict[str, str]" = OrderedDict()
+
+    @classmethod
+    async def load(cls, db, min_capacity: int = 100_000, headroom: float = 2.0, **kwargs) -> "ReplayGuard":
+        """Build a guard sized for, and filled with, the txn_ids already stored"""
+        query = {"txn_id": {"$type": "string"}}
+        existing = await db.donations.count_documents(query)
+        guard = cls(capacity=max(min_capacity, int(existing * headroom)), **kwargs)
+        # Covered by the partial txn_id index
+        async for donation in db.donations.find(query, {"_id": 0, "txn_id": 1}):
+            guard.bloom.add(donation["txn_id"])
+        logger.info(f"Loaded {guard.bloom.count} payment IDs into the replay filter")
+        return guard
+
+    def verified_donation(self, txn_id: str) -> Optional[str]:
+        """Donation a recently verified ``txn_id`` belongs to, if known exactly"""
+        donation_id = self._recent.get(txn_id)
+        if donation_id is not None:
+            self._recent.move_to_end(txn_id)
+        return donation_id
+
+    def might_be_replay(self, txn_id: str) -> bool:
+        return txn_id in self.bloom
+
+    def remember(self, txn_id: str, donation_id: str):
+        if txn_id not in self._recent:
+            self.bloom.add(txn_id)
+            if self.bloom.count == self.bloom.capacity:
+                logger.warning("Replay filter is at capacity; false positives will rise until restart")
+        self._recent[txn_id] = donation_id
+        self._recent.move_to_end(txn_id)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
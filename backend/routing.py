@@ -0,0 +1,91 @@
+"""Read routing between the primary and staleness-bounded secondaries.
+
+Feed and analytics routes read through ``secondary_database``, which prefers
+secondaries no more than ``maxStalenessSeconds`` behind the primary. Writes and
+read-your-write paths (register, verify) stay on the primary.
+
+To keep a donor's own fresh donation visible on a secondary, writes return an
+``X-Causal-Token`` header holding the session's cluster and operation time.
+Reads that send it back run in a causally consistent session advanced to that
+point, so the secondary waits until it has caught up before answering. That
+covers documents the write itself changed, such as the donation on the user
+timeline; summaries the outbox worker derives later (``/user/{id}/impact``)
+stay eventually consistent.
+
+Tokens come back from clients, so they are signed with an HMAC key
+(``CAUSAL_TOKEN_SECRET``, shared by every API instance). Unsigned, tampered or
+malformed tokens are ignored and the read runs without them.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import bson
+from pymongo.read_preferences import SecondaryPreferred
+
+logger = logging.getLogger(__name__)
+
+CAUSAL_TOKEN_HEADER = "X-Causal-Token"
+# The smallest bound the drivers accept
+MIN_MAX_STALENESS_SECONDS = 90
+
+
+def secondary_database(db, max_staleness_seconds: int):
+    """Database handle that reads from secondaries within the staleness bound.
+
+    A bound of 0 or less disables routing and keeps every read on the primary.
+    """
+    if max_staleness_seconds <= 0:
+        return db
+    max_staleness = max(MIN_MAX_STALENESS_SECONDS, max_staleness_seconds)
+    return db.with_options(read_preference=SecondaryPreferred(max_staleness=max_staleness))
+
+
+def _sign(payload: bytes, key: bytes) -> str:
+    return base64.urlsafe_b64encode(hmac.new(key, payload, hashlib.sha256).digest()).decode()
+
+
+def encode_causal_token(session, key: bytes) -> Optional[str]:
+    """Serialize and sign where a session's writes landed; None on a standalone server"""
+    if session.operation_time is None or session.cluster_time is None:
+        return None
+    payload = bson.encode({"operationTime": session.operation_time, "clusterTime": session.cluster_time})
+    return f"{base64.urlsafe_b64encode(payload).decode()}.{_sign(payload, key)}"
+
+
+def decode_causal_token(token: Optional[str], key: bytes) -> Optional[dict]:
+    """Parse a token from a client; unsigned, tampered and malformed tokens are ignored"""
+    if not token:
+        return None
+    encoded, _, signature = token.partition(".")
+    try:
+        payload = base64.urlsafe_b64decode(encoded.encode())
+        if not hmac.compare_digest(signature, _sign(payload, key)):
+            return None
+        payload = bson.decode(payload)
+    except (binascii.Error, bson.errors.BSONError, ValueError, TypeError):
+        return None
+    cluster_time = payload.get("clusterTime")
+    if not isinstance(payload.get("operationTime"), bson.Timestamp) or not isinstance(cluster_time, dict) \
+            or not isinstance(cluster_time.get("clusterTime"), bson.Timestamp):
+        return None
+    return payload
+
+
+@asynccontextmanager
+async def causal_session(client, token: Optional[str] = None, key: Optional[bytes] = None):
+    """Causally consistent session, advanced past the client's last write if given"""
+    causal = decode_causal_token(token, key) if key else None
+    async with await client.start_session(causal_consistency=True) as session:
+        if causal:
+            try:
+                session.advance_cluster_time(causal["clusterTime"])
+                session.advance_operation_time(causal["operationTime"])
+            except (TypeError, ValueError) as e:
+                # Still a valid read, only without the read-your-write guarantee
+                logger.warning(f"Ignoring unusable causal token: {e}")
+        yield session
@@ -1,6 +1,7 @@
 import express from "express";
 import cors from "cors";
 import { MongoClient } from "mongodb";
+import { randomBytes } from "crypto";
 import dotenv from "dotenv";
 
 dotenv.config();
@@ -12,6 +13,8 @@ app.use(express.json());
 // ✅ MongoDB connection
 const uri = process.env.MONGO_URL || "mongodb://127.0.0.1:27017";
 const client = new MongoClient(uri);
+
+
 let db;
 
 async function connectDB() {
@@ -222,6 +225,31 @@ app.get("/api/transactions/user/:userId", async (req, res) => {
 });
 
 
+// ✅ Bulk transaction lookup by order (payment) ID, used by the platform backend
+app.post("/api/transactions/lookup", async (req, res) => {
+  const { order_ids } = req.body;
+
+  if (!Array.isArray(order_ids) || order_ids.length > 1000) {
+    return res.status(400).json({ status: "FAILURE", error: "order_ids must be an array of at most 1000 IDs" });
+  }
+
+  try {
+    const transactions = db.collection("transactions");
+    const matches = await transactions
+      .find({ orderId: { $in: order_ids } })
+      .project({ _id: 0, txnId: 1, orderId: 1, donationId: 1, amount: 1, status: 1 })
+      .toArray();
+
+    return res.json({
+      status: "SUCCESS",
+      transactions: matches
+    });
+  } catch (err) {
+    console.error("❌ Transaction lookup error:", err);
+    return res.status(500).json({ status: "FAILURE", error: "Server error" });
+  }
+});
+
 app.post("/api/payment/verify", async (req, res) => {
   const { donation_id, payment_id, upi_id, pin, amount } = req.body;
 
@@ -265,7 +293,8 @@ app.post("/api/payment/verify", async (req, res) => {
 
     // ✅ Deduct + credit
     const newBalance = user.balance - amt;
-    const txnId = "TXN" + Date.now();
+    // Unique even for payments settled in the same millisecond
+    const txnId = "TXN" + Date.now() + randomBytes(6).toString("hex").toUpperCase();
 
     await accounts.updateOne({ upiId: cleanUpi }, { $set: { balance: newBalance } });
     await accounts.updateOne({ upiId: merchantUpi }, { $inc: { balance: amt } });
@@ -285,48 +314,9 @@ app.post("/api/payment/verify", async (req, res) => {
       timestamp: new Date(),
     });
 
-    let fundName = "fund@upi"
-
-    if (donation_id) {
-      try {
-        const donationClient = new MongoClient(process.env.MONGO_URL || "mongodb://127.0.0.1:27017");
-        await donationClient.connect();
-        const hopeorbDB = donationClient.db("hopeorb_db");
-
-        const donations = hopeorbDB.collection("donations");
-        const charities = hopeorbDB.collection("charities");
-
-        const donation = await donations.findOne({ id: donation_id });
-        if (donation) {
-          const charity = await charities.findOne({ id: donation.charity_id });
-          if (charity) {
-            fundName = charity.name; // ✅ use the fund’s name for logging
-
-            await charities.updateOne(
-              { id: donation.charity_id },
-              { $inc: { current_amount: amt } }
-            );
-            await donations.updateOne(
-              { id: donation_id },
-              { $set: { status: "completed", txn_id: txnId, updated_at: new Date() } }
-            );
-            console.log(`💰 Updated charity: ${charity.name} (+₹${amt})`);
-          } else {
-            console.warn("⚠️ Charity not found for donation:", donation.charity_id);
-          }
-        } else {
-          console.warn("⚠️ Donation not found in hopeorb_db:", donation_id);
-        }
-
-        await donationClient.close();
-      } catch (updateErr) {
-        console.error("❌ Error updating charity in hopeorb_db:", updateErr);
-      }
-    }
-
-    // ✅ Use fundName in transaction log
-    console.log(`✅ Transaction complete: ₹${amt} from ${cleanUpi} → ${fundName}`);
-
+    // The platform backend completes the donation once its POST /api/payment/verify
+    // finds this transaction through /api/transactions/lookup; charity totals and
+    // hope points are then applied by its outbox, exactly once.
     console.log(`✅ Payment verified: ₹${amt} deducted from ${cleanUpi}`);
 
     return res.json({
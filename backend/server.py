@@ -1,31 +1,105 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Depends, Request, Response, Header
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import secrets
+import time
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 from datetime import datetime, timezone
 import base64
-import httpx
+from archive import DEFAULT_ARCHIVE_DIR, load_archived_donations, merge_tiers
+from outbox import OutboxWorker, new_outbox_record
+from diagnostics import LoopLagMonitor, ProfilingMiddleware
+from indexes import ensure_indexes
+from impact import current_streak
+from bank import BankClient, BankUnavailableError
+from replay import ReplayGuard
+from pymongo.errors import DuplicateKeyError
+from routing import CAUSAL_TOKEN_HEADER, causal_session, encode_causal_token, secondary_database
+import ids
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+logger = logging.getLogger(__name__)
 
-# Create the main app without a prefix
-app = FastAPI()
+class Settings(BaseModel):
+    """Runtime configuration, read from the environment by default"""
+    mongo_url: Optional[str] = None
+    db_name: Optional[str] = None
+    cors_origins: List[str] = ["*"]
+    archive_dir: Path = DEFAULT_ARCHIVE_DIR
+    outbox_workers: int = 2
+    outbox_batch_size: int = 50
+    # Connections opened before the first request is served
+    mongo_min_pool_size: int = 10
+    startup_budget_ms: float = 2000.0
+    # Diagnostics are only installed when configured
+    profile_dir: Optional[Path] = None
+    profile_sample_rate: float = 0.0
+    # X-Profile requests must carry this in X-Profile-Token; the header is ignored when unset
+    profile_secret: Optional[str] = None
+    profile_max_concurrent: int = 2
+    profile_max_files: int = 1000
+    loop_lag_threshold_ms: float = 0.0
+    # Bank verification server; payments are not checked against it when unset
+    bank_url: Optional[str] = None
+    bank_timeout: float = 2.0
+    bank_batch_window_ms: float = 5.0
+    # Feed and analytics reads may go to secondaries this far behind; 0 keeps them on the primary
+    read_max_staleness_seconds: int = 90
+    # HMAC key for X-Causal-Token; set the same value on every instance behind a load balancer
+    causal_token_secret: Optional[str] = None
+    # Store document UUIDs in _id as 16-byte BSON Binary instead of strings
+    uuid_binary: bool = False
+    # Also match pre-migration documents (ObjectId _id plus an id field) while migrate_ids.py runs
+    legacy_id_fallback: bool = False
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        env = os.environ
+        return cls(
+            mongo_url=env.get('MONGO_URL'),
+            db_name=env.get('DB_NAME'),
+            cors_origins=env.get('CORS_ORIGINS', '*').split(','),
+            archive_dir=Path(env.get('ARCHIVE_DIR', DEFAULT_ARCHIVE_DIR)),
+            outbox_workers=int(env.get('OUTBOX_WORKERS', 2)),
+            outbox_batch_size=int(env.get('OUTBOX_BATCH_SIZE', 50)),
+            mongo_min_pool_size=int(env.get('MONGO_MIN_POOL_SIZE', 10)),
+            startup_budget_ms=float(env.get('STARTUP_BUDGET_MS', 2000)),
+            profile_dir=env.get('PROFILE_DIR') or None,
+            profile_sample_rate=float(env.get('PROFILE_SAMPLE_RATE', 0)),
+            profile_secret=env.get('PROFILE_SECRET') or None,
+            profile_max_concurrent=int(env.get('PROFILE_MAX_CONCURRENT', 2)),
+            profile_max_files=int(env.get('PROFILE_MAX_FILES', 1000)),
+            loop_lag_threshold_ms=float(env.get('LOOP_LAG_THRESHOLD_MS', 0)),
+            bank_url=env.get('BANK_URL') or None,
+            bank_timeout=float(env.get('BANK_TIMEOUT', 2.0)),
+            bank_batch_window_ms=float(env.get('BANK_BATCH_WINDOW_MS', 5)),
+            read_max_staleness_seconds=int(env.get('READ_MAX_STALENESS_SECONDS', 90)),
+            causal_token_secret=env.get('CAUSAL_TOKEN_SECRET') or None,
+            uuid_binary=env.get('UUID_BINARY', '0') == '1',
+            legacy_id_fallback=env.get('ID_LEGACY_FALLBACK', '0') == '1',
+        )
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+def get_db(request: Request):
+    """Database handle opened by the app lifespan"""
+    return request.app.state.db
+
+def get_secondary_db(request: Request):
+    """Staleness-bounded secondary reads for feed and analytics routes"""
+    return request.app.state.secondary_db
+
 # Define Models
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -64,6 +138,10 @@ class Donation(BaseModel):
     status: str = "pending"  # "pending", "completed", "failed"
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class DonationFeedItem(Donation):
+    has_audio: bool = False
+    duration: Optional[float] = None
+
 class DonationCreate(BaseModel):
     user_id: str
     charity_id: str
@@ -98,6 +176,28 @@ class AudioMessageCreate(BaseModel):
     audio_data: str
     duration: float
 
+class AudioLookupRequest(BaseModel):
+    donation_ids: List[str] = Field(max_length=1000)
+
+class AudioPresence(BaseModel):
+    donation_id: str
+    has_audio: bool
+    duration: Optional[float] = None
+
+class CharityImpact(BaseModel):
+    amount: float
+    count: int
+
+class UserImpact(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    user_id: str
+    total_amount: float = 0.0
+    donation_count: int = 0
+    per_charity: Dict[str, CharityImpact] = {}
+    first_donation_at: Optional[datetime] = None
+    last_donation_at: Optional[datetime] = None
+    current_streak: int = 0
+
 class LeaderboardEntry(BaseModel):
     user_id: str
     name: str
@@ -139,14 +239,56 @@ def calculate_ripple_properties(amount: float) -> dict:
     
     return {"size": ripple_size, "color": color}
 
+# Static charity fields never change after creation, so they are cached per app
+CHARITY_DETAIL_FIELDS = {"id": 1, "name": 1, "charity_type": 1, "visual_type": 1}
+
+async def load_charity_cache(db) -> Dict[str, dict]:
+    """Load static charity details keyed by charity ID"""
+    charities = await db.charities.find({}, CHARITY_DETAIL_FIELDS).to_list(1000)
+    return {charity["id"]: charity for charity in map(ids.to_api, charities)}
+
+async def get_charity_details(app: FastAPI, db, charity_ids) -> Dict[str, dict]:
+    """Resolve charity details from the cache, fetching misses in one query"""
+    cache = app.state.charity_cache
+    missing = [cid for cid in charity_ids if cid not in cache]
+    if missing:
+        charities = await db.charities.find(ids.ids_filter(missing), CHARITY_DETAIL_FIELDS).to_list(len(missing))
+        cache.update({charity["id"]: charity for charity in map(ids.to_api, charities)})
+    return {cid: cache[cid] for cid in charity_ids if cid in cache}
+
+async def lookup_audio_presence(db, donation_ids) -> Dict[str, float]:
+    """Map donation IDs that have a voice note to its duration, in one query"""
+    unique_ids = list(set(donation_ids))
+    if not unique_ids:
+        return {}
+    # Covered by the (donation_id, duration) index; audio_data is never read
+    audio = await db.audio_messages.find(
+        {"donation_id": {"$in": unique_ids}},
+        {"_id": 0, "donation_id": 1, "duration": 1}
+    ).to_list(None)
+    return {a["donation_id"]: a.get("duration") for a in audio}
+
+def amounts_match(paid, expected: float) -> bool:
+    """Whether a bank amount equals the donation amount, to the paisa"""
+    try:
+        return round(float(paid), 2) == round(float(expected), 2)
+    except (TypeError, ValueError):
+        return False
+
+def set_causal_token(request: Request, response: Response, session):
+    """Hand the client a token for reading its own write from a secondary"""
+    token = encode_causal_token(session, request.app.state.causal_token_key)
+    if token:
+        response.headers[CAUSAL_TOKEN_HEADER] = token
+
 # API Routes
 @api_router.post("/register", response_model=User)
-async def register_user(user_input: UserCreate):
+async def register_user(user_input: UserCreate, db=Depends(get_db)):
     """Register a new user"""
     # Check if email already exists
-    existing_user = await db.users.find_one({"email": user_input.email})
+    existing_user = await db.users.find_one({"email": user_input.email}, {"outbox_keys": 0})
     if existing_user:
-        existing_user['_id'] = str(existing_user['_id'])
+        existing_user = ids.to_api(existing_user)
         if isinstance(existing_user['created_at'], str):
             existing_user['created_at'] = datetime.fromisoformat(existing_user['created_at'])
         return User(**existing_user)
@@ -159,16 +301,16 @@ async def register_user(user_input: UserCreate):
         emotion=user_input.emotion or "neutral"
     )
     
-    doc = user.model_dump()
+    doc = ids.to_document(user.model_dump())
     doc['created_at'] = doc['created_at'].isoformat()
     await db.users.insert_one(doc)
     
     return user
 
 @api_router.get("/user/{user_id}", response_model=User)
-async def get_user(user_id: str):
+async def get_user(user_id: str, db=Depends(get_db)):
     """Get user by ID"""
-    user = await db.users.find_one({"id": user_id}, {"_id": 0})
+    user = ids.to_api(await db.users.find_one(ids.id_filter(user_id), {"outbox_keys": 0}))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -179,7 +321,7 @@ async def get_user(user_id: str):
 
 #@api_router.post("/donate", response_model=Donation)
 @api_router.post("/donations", response_model=Donation)
-async def create_donation(donation_input: DonationCreate):
+async def create_donation(donation_input: DonationCreate, request: Request, response: Response, db=Depends(get_db)):
     """Create a new donation"""
     ripple_props = calculate_ripple_properties(donation_input.amount)
     
@@ -192,27 +334,32 @@ async def create_donation(donation_input: DonationCreate):
         status="pending"
     )
     
-    doc = donation.model_dump()
+    doc = ids.to_document(donation.model_dump())
     doc['timestamp'] = doc['timestamp'].isoformat()
-    await db.donations.insert_one(doc)
+    async with causal_session(request.app.state.client) as session:
+        await db.donations.insert_one(doc, session=session)
+        set_causal_token(request, response, session)
     
     return donation
 
-@api_router.get("/donations", response_model=List[Donation])
-async def get_donations(limit: int = 100):
+@api_router.get("/donations", response_model=List[DonationFeedItem])
+async def get_donations(limit: int = 100, db=Depends(get_secondary_db)):
     if limit <= 0:
         raise HTTPException(status_code = 400, detail = "Limit must be positive")
     limit = min(limit, 1000)
 
     """Get recent donations for ripple visualization"""
     donations = await db.donations.find(
-        {"status": "completed"}, 
-        {"_id": 0}
+        {"status": "completed"}
     ).sort("timestamp", -1).limit(limit).to_list(limit)
+    donations = [ids.to_api(d) for d in donations]
+    audio = await lookup_audio_presence(db, [d["id"] for d in donations])
     
     for donation in donations:
         if isinstance(donation['timestamp'], str):
             donation['timestamp'] = datetime.fromisoformat(donation['timestamp'])
+        donation['has_audio'] = donation['id'] in audio
+        donation['duration'] = audio.get(donation['id'])
     
     return donations
 
@@ -234,49 +381,93 @@ async def generate_upi_payment(payment_req: PaymentRequest):
     )
 
 @api_router.post("/payment/verify")
-async def verify_payment(verify_req: PaymentVerify):
+async def verify_payment(verify_req: PaymentVerify, request: Request, response: Response, db=Depends(get_db)):
     """Verify payment through bank server"""
-    
-    donation = await db.donations.find_one({"id": verify_req.donation_id})
-    if not donation:
-        raise HTTPException(status_code=404, detail="Donation not found")
-    
-    try:
-        # Payment is already verified by bank server
-        # Update donation status and related records
-        
-        await db.donations.update_one(
-            {"id": verify_req.donation_id},
-            {"$set": {
-                "status": "completed",
-                "txn_id": verify_req.payment_id,
-                "payment_timestamp": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-        
-        await db.charities.update_one(
-            {"id": donation["charity_id"]},
-            {"$inc": {"current_amount": donation["amount"]}}
-        )
-        
-        hope_points = int(donation["amount"] / 10)
-        await db.users.update_one(
-            {"id": donation["user_id"]},
-            {"$inc": {"hope_points": hope_points}}
-        )
-        
+    replay_guard = request.app.state.replay_guard
+
+    def already_verified(donation_id: str) -> dict:
+        # Replays are acknowledged but never re-apply the side effects
+        if donation_id != verify_req.donation_id:
+            raise HTTPException(status_code=409, detail="Payment already used for another donation")
         return {
             "success": True,
-            "message": "Payment verified successfully",
+            "message": "Payment already verified",
             "txnId": verify_req.payment_id
         }
-                
+
+    # Obvious replays are answered from memory, without a DB round trip
+    known_donation = replay_guard.verified_donation(verify_req.payment_id)
+    if known_donation:
+        return already_verified(known_donation)
+
+    # A Bloom filter miss proves the payment is new; a hit is confirmed in Mongo
+    if replay_guard.might_be_replay(verify_req.payment_id):
+        previous = ids.to_api(await db.donations.find_one({"txn_id": verify_req.payment_id}, {"id": 1}))
+        if previous:
+            replay_guard.remember(verify_req.payment_id, previous["id"])
+            return already_verified(previous["id"])
+
+    completion = {
+        "status": "completed",
+        "txn_id": verify_req.payment_id,
+        "payment_timestamp": datetime.now(timezone.utc).isoformat(),
+        "outbox": new_outbox_record(verify_req.donation_id, verify_req.payment_id)
+    }
+
+    bank = request.app.state.bank
+    if bank:
+        donation = await db.donations.find_one(ids.id_filter(verify_req.donation_id), {"_id": 0, "amount": 1})
+        if not donation:
+            raise HTTPException(status_code=404, detail="Donation not found")
+        try:
+            bank_txn = await bank.find_transaction(verify_req.payment_id)
+        except BankUnavailableError:
+            raise HTTPException(status_code=503, detail="Bank verification unavailable")
+        # A bank record naming another donation, or paying a different amount, cannot complete this one
+        if not bank_txn or bank_txn.get("donationId") not in (None, verify_req.donation_id):
+            raise HTTPException(status_code=402, detail="Payment not confirmed by bank")
+        if not amounts_match(bank_txn.get("amount"), donation["amount"]):
+            raise HTTPException(status_code=402, detail="Paid amount does not match the donation")
+        completion["bank_txn_id"] = bank_txn.get("txnId")
+
+    try:
+        # Complete the donation and queue its side effects in one write;
+        # charity totals, hope points and notifications are applied by outbox_worker.
+        # Only a donation that is not yet completed can match, so a replay racing
+        # past the filter cannot count twice.
+        async with causal_session(request.app.state.client) as session:
+            result = await db.donations.update_one(
+                {**ids.id_filter(verify_req.donation_id), "status": {"$ne": "completed"}},
+                {"$set": completion},
+                session=session
+            )
+            set_causal_token(request, response, session)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Payment already used for another donation")
     except Exception as e:
         logging.error(f"Payment verification error: {e}")
         raise HTTPException(status_code=500, detail="Payment verification failed")
 
+    if result.matched_count == 0:
+        donation = await db.donations.find_one(ids.id_filter(verify_req.donation_id), {"_id": 0, "txn_id": 1})
+        if not donation:
+            raise HTTPException(status_code=404, detail="Donation not found")
+        if donation.get("txn_id") != verify_req.payment_id:
+            raise HTTPException(status_code=409, detail="Donation already completed with another payment")
+        replay_guard.remember(verify_req.payment_id, verify_req.donation_id)
+        return already_verified(verify_req.donation_id)
+
+    replay_guard.remember(verify_req.payment_id, verify_req.donation_id)
+    request.app.state.outbox_worker.notify()
+
+    return {
+        "success": True,
+        "message": "Payment verified successfully",
+        "txnId": verify_req.payment_id
+    }
+
 @api_router.post("/audio-message", response_model=AudioMessage)
-async def create_audio_message(audio_input: AudioMessageCreate):
+async def create_audio_message(audio_input: AudioMessageCreate, db=Depends(get_db)):
     import re
     MAX_AUDIO_SIZE = 2_000_000
 
@@ -295,16 +486,25 @@ async def create_audio_message(audio_input: AudioMessageCreate):
         duration=audio_input.duration
     )
     
-    doc = audio_msg.model_dump()
+    doc = ids.to_document(audio_msg.model_dump())
     doc['created_at'] = doc['created_at'].isoformat()
     await db.audio_messages.insert_one(doc)
     
     return audio_msg
 
+@api_router.post("/audio-message/lookup", response_model=List[AudioPresence])
+async def lookup_audio_messages(lookup: AudioLookupRequest, db=Depends(get_secondary_db)):
+    """Report which donations have a voice note, without fetching the audio"""
+    audio = await lookup_audio_presence(db, lookup.donation_ids)
+    return [
+        AudioPresence(donation_id=donation_id, has_audio=donation_id in audio, duration=audio.get(donation_id))
+        for donation_id in dict.fromkeys(lookup.donation_ids)
+    ]
+
 @api_router.get("/audio-message/{donation_id}")
-async def get_audio_message(donation_id: str):
+async def get_audio_message(donation_id: str, db=Depends(get_db)):
     """Get audio message by donation ID"""
-    audio = await db.audio_messages.find_one({"donation_id": donation_id}, {"_id": 0})
+    audio = ids.to_api(await db.audio_messages.find_one({"donation_id": donation_id}))
     if not audio:
         return None
     
@@ -314,13 +514,13 @@ async def get_audio_message(donation_id: str):
     return audio
 
 @api_router.get("/charities", response_model=List[Charity])
-async def get_charities():
+async def get_charities(db=Depends(get_secondary_db)):
     """Get all charities"""
-    charities = await db.charities.find({}, {"_id": 0}).to_list(1000)
-    return charities
+    charities = await db.charities.find({}, {"outbox_keys": 0}).to_list(1000)
+    return [ids.to_api(charity) for charity in charities]
 
 @api_router.get("/leaderboard", response_model=List[LeaderboardEntry])
-async def get_leaderboard(limit: int = 10):
+async def get_leaderboard(limit: int = 10, db=Depends(get_secondary_db)):
     """Get leaderboard based on consistency"""
     # Get users with most donations this week
     week_ago = datetime.now(timezone.utc).timestamp() - (7 * 24 * 60 * 60)
@@ -344,7 +544,7 @@ async def get_leaderboard(limit: int = 10):
     
     leaderboard = []
     for result in results:
-        user = await db.users.find_one({"id": result["_id"]}, {"_id": 0})
+        user = ids.to_api(await db.users.find_one(ids.id_filter(result["_id"]), {"outbox_keys": 0}))
         if user:
             leaderboard.append(LeaderboardEntry(
                 user_id=user["id"],
@@ -357,16 +557,26 @@ async def get_leaderboard(limit: int = 10):
     return leaderboard
 
 @api_router.get("/user/{user_id}/timeline")
-async def get_user_timeline(user_id: str):
+async def get_user_timeline(user_id: str, request: Request, db=Depends(get_secondary_db),
+                            causal_token: Optional[str] = Header(None, alias=CAUSAL_TOKEN_HEADER)):
     """Get user's donation timeline"""
-    donations = await db.donations.find(
-        {"user_id": user_id, "status": "completed"},
-        {"_id": 0}
-    ).sort("timestamp", -1).to_list(1000)
+    # With the donor's causal token the secondary waits until their last write is visible
+    async with causal_session(request.app.state.client, causal_token, request.app.state.causal_token_key) as session:
+        donations = await db.donations.find(
+            {"user_id": user_id, "status": "completed"},
+            session=session
+        ).sort("timestamp", -1).to_list(1000)
+    donations = [ids.to_api(d) for d in donations]
+    archived = await load_archived_donations(db, request.app.state.settings.archive_dir, user_id)
+    donations = merge_tiers(donations, archived, limit=1000)
+    charities, audio = await asyncio.gather(
+        get_charity_details(request.app, db, {d["charity_id"] for d in donations}),
+        lookup_audio_presence(db, [d["id"] for d in donations]),
+    )
     
     timeline = []
     for donation in donations:
-        charity = await db.charities.find_one({"id": donation["charity_id"]}, {"_id": 0})
+        charity = charities.get(donation["charity_id"])
         if charity:
             timeline.append({
                 "donation_id": donation["id"],
@@ -374,14 +584,28 @@ async def get_user_timeline(user_id: str):
                 "charity_name": charity["name"],
                 "charity_type": charity["charity_type"],
                 "visual_type": charity["visual_type"],
-                "timestamp": donation["timestamp"]
+                "timestamp": donation["timestamp"],
+                "has_audio": donation["id"] in audio,
+                "duration": audio.get(donation["id"])
             })
     
     return timeline
 
+@api_router.get("/user/{user_id}/impact", response_model=UserImpact)
+async def get_user_impact(user_id: str, db=Depends(get_secondary_db)):
+    """Get a user's giving summary, maintained as payments are verified"""
+    # Eventually consistent: the outbox worker folds a verified payment in after
+    # the verify write, so a causal token cannot make it visible any sooner
+    summary = await db.user_impact.find_one({"user_id": user_id}, {"_id": 0, "outbox_keys": 0})
+    if not summary:
+        return UserImpact(user_id=user_id)
+    
+    summary["current_streak"] = current_streak(summary)
+    return UserImpact(**summary)
+
 # Initialize default charities
 @api_router.post("/init-charities")
-async def initialize_charities():
+async def initialize_charities(db=Depends(get_db)):
     """Initialize default charities (call once)"""
     existing = await db.charities.count_documents({})
     if existing > 0:
@@ -433,28 +657,133 @@ async def initialize_charities():
     ]
     
     for charity in charities:
-        await db.charities.insert_one(charity.model_dump())
+        await db.charities.insert_one(ids.to_document(charity.model_dump()))
     
     return {"message": "Charities initialized successfully"}
 
-# Include the router in the main app
-app.include_router(api_router)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def prewarm_pool(db, size: int):
+    """Open ``size`` pooled connections up front instead of on first requests"""
+    await asyncio.gather(*(db.command("ping") for _ in range(max(1, size))))
+
+async def probe_health(db, settings: Settings):
+    """Fail startup early if the database or the archive tier is unusable"""
+    await db.command("ping")
+    archive_parent = Path(settings.archive_dir).parent
+    if archive_parent.exists() and not os.access(archive_parent, os.W_OK):
+        raise RuntimeError(f"Archive directory {settings.archive_dir} is not writable")
+
+async def release_resources(client, outbox_worker=None, bank=None, lag_monitor=None):
+    """Stop background work and close connections, in reverse start order"""
+    if lag_monitor:
+        await lag_monitor.stop()
+    if bank:
+        await bank.close()
+    if outbox_worker:
+        await outbox_worker.stop()
+    client.close()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    settings = app.state.settings
+    if not settings.mongo_url or not settings.db_name:
+        raise RuntimeError("MONGO_URL and DB_NAME must be configured")
+
+    started = time.perf_counter()
+    ids.configure(binary=settings.uuid_binary, legacy_fallback=settings.legacy_id_fallback)
+    client = AsyncIOMotorClient(settings.mongo_url, minPoolSize=settings.mongo_min_pool_size)
+    db = client[settings.db_name]
+    app.state.client = client
+    app.state.db = db
+    app.state.secondary_db = secondary_database(db, settings.read_max_staleness_seconds)
+
+    outbox_worker = bank = lag_monitor = None
+    try:
+        _, charity_cache, _, _ = await asyncio.gather(
+            prewarm_pool(db, settings.mongo_min_pool_size),
+            load_charity_cache(db),
+            probe_health(db, settings),
+            ensure_indexes(db),
+        )
+        app.state.charity_cache = charity_cache
+        # Loaded after ensure_indexes so the txn_id scan is index-covered
+        app.state.replay_guard = await ReplayGuard.load(db)
+
+        # Background pool applying post-payment side effects
+        outbox_worker = OutboxWorker(
+            db,
+            concurrency=settings.outbox_workers,
+            batch_size=settings.outbox_batch_size,
+        )
+        await outbox_worker.start()
+        app.state.outbox_worker = outbox_worker
+
+        # One pooled, keep-alive connection set to the bank for the whole process
+        if settings.bank_url:
+            bank = BankClient(
+                settings.bank_url,
+                timeout=settings.bank_timeout,
+                batch_window=settings.bank_batch_window_ms / 1000,
+            )
+            await bank.start()
+        app.state.bank = bank
+
+        if settings.loop_lag_threshold_ms > 0:
+            lag_monitor = LoopLagMonitor(settings.loop_lag_threshold_ms)
+            await lag_monitor.start()
+    except Exception:
+        await release_resources(client, outbox_worker, bank, lag_monitor)
+        raise
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if elapsed_ms > settings.startup_budget_ms:
+        logger.warning(f"Startup took {elapsed_ms:.0f} ms, over the {settings.startup_budget_ms:.0f} ms budget")
+    else:
+        logger.info(f"Startup completed in {elapsed_ms:.0f} ms")
+
+    try:
+        yield
+    finally:
+        await release_resources(client, outbox_worker, bank, lag_monitor)
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """Build the application; resources are opened by the lifespan, not here"""
+    settings = settings or Settings.from_env()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings
+    # Without a configured secret, tokens are only honoured by the instance that issued them
+    app.state.causal_token_key = (
+        settings.causal_token_secret.encode() if settings.causal_token_secret else secrets.token_bytes(32)
+    )
+
+    # Include the router in the main app
+    app.include_router(api_router)
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=settings.cors_origins,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[CAUSAL_TOKEN_HEADER],
+    )
+
+    if settings.profile_dir:
+        app.add_middleware(
+            ProfilingMiddleware,
+            profile_dir=settings.profile_dir,
+            sample_rate=settings.profile_sample_rate,
+            secret=settings.profile_secret,
+            max_concurrent=settings.profile_max_concurrent,
+            max_profiles=settings.profile_max_files,
+        )
+
+    return app
+
+app = create_app()
\ No newline at end of file
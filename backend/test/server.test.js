@@ -112,6 +112,26 @@ describe("🌟 Micro Donation Bank API", function () {
   });
 
   
+  // Bulk transaction lookup
+  it("POST /api/transactions/lookup → should return transactions for known orders", async function () {
+    const res = await request(app)
+      .post("/api/transactions/lookup")
+      .send({ order_ids: ["test_payment", "unknown_payment"] });
+    expect(res.status).to.equal(200);
+    expect(res.body.status).to.equal("SUCCESS");
+    expect(res.body.transactions).to.be.an("array");
+    res.body.transactions.forEach((txn) => {
+      expect(txn.orderId).to.equal("test_payment");
+      expect(txn.status).to.equal("SUCCESS");
+    });
+  });
+
+  it("POST /api/transactions/lookup → should reject a missing order list", async function () {
+    const res = await request(app).post("/api/transactions/lookup").send({});
+    expect(res.status).to.equal(400);
+    expect(res.body.status).to.equal("FAILURE");
+  });
+
   it("GET /api/transactions/user/:userId → should return recent transactions", async function () {
     const res = await request(app).get("/api/transactions/user/c3576984-978c-40b8-a5e2-0193feb852c5");
     expect(res.status).to.equal(200);
@@ -121,6 +121,11 @@ export default function PaymentCube({ donation, onClose, onComplete }) {
       });
       
       if (response.data.success) {
+        // The platform confirms the payment with the bank and completes the donation
+        await axios.post(`${API}/payment/verify`, {
+          donation_id: donation.id,
+          payment_id: paymentData.payment_id
+        });
         toast.success('Payment successful! 🎉');
         setTimeout(() => {
           onComplete();
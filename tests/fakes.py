@@ -0,0 +1,453 @@
+"""In-memory stand-ins for the Motor client, database and collections.
+
+Only the query operators, update operators, aggregation stages and
+collection methods that the backend issues are supported. Unique indexes are
+enforced on ``_id`` and on the fields passed as ``unique`` (documents without
+the field are exempt, like the partial ``txn_id_1`` index).
+"""
+import copy
+from types import SimpleNamespace
+
+from bson import Binary, ObjectId
+from pymongo import InsertOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+MISSING = object()
+DUPLICATE_KEY_ERROR = 11000
+
+TYPE_CHECKS = {
+    "string": lambda value: isinstance(value, str),
+    "objectId": lambda value: isinstance(value, ObjectId),
+    "binData": lambda value: isinstance(value, Binary),
+}
+
+
+def get_path(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return MISSING
+        value = value[part]
+    return value
+
+
+def set_path(doc, path, value):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[leaf] = value
+
+
+def unset_path(doc, path):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(leaf, None)
+
+
+def _equals(value, expected):
+    if value is MISSING:
+        return expected is None
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compare(value, bound, op):
+    if value is MISSING or value is None:
+        return False
+    try:
+        return op(value, bound)
+    except TypeError:
+        return False
+
+
+def _match_value(value, condition):
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        return _equals(value, condition)
+    for op, arg in condition.items():
+        if op == "$eq":
+            ok = _equals(value, arg)
+        elif op == "$ne":
+            ok = not _equals(value, arg)
+        elif op == "$in":
+            ok = any(_equals(value, item) for item in arg)
+        elif op == "$nin":
+            ok = not any(_equals(value, item) for item in arg)
+        elif op == "$lt":
+            ok = _compare(value, arg, lambda a, b: a < b)
+        elif op == "$lte":
+            ok = _compare(value, arg, lambda a, b: a <= b)
+        elif op == "$gt":
+            ok = _compare(value, arg, lambda a, b: a > b)
+        elif op == "$gte":
+            ok = _compare(value, arg, lambda a, b: a >= b)
+        elif op == "$exists":
+            ok = (value is not MISSING) == bool(arg)
+        elif op == "$type":
+            ok = value is not MISSING and TYPE_CHECKS[arg](value)
+        else:
+            raise NotImplementedError(op)
+        if not ok:
+            return False
+    return True
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif not _match_value(get_path(doc, key), condition):
+            return False
+    return True
+
+
+def apply_update(doc, update, inserting=False):
+    if isinstance(update, list):
+        raise NotImplementedError("pipeline updates need a real mongod")
+    for op, fields in update.items():
+        for path, arg in fields.items():
+            if op == "$set":
+                set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$setOnInsert":
+                if inserting:
+                    set_path(doc, path, copy.deepcopy(arg))
+            elif op == "$unset":
+                unset_path(doc, path)
+            elif op == "$inc":
+                current = get_path(doc, path)
+                set_path(doc, path, (0 if current is MISSING else current) + arg)
+            elif op == "$push":
+                current = get_path(doc, path)
+                items = list(current) if current is not MISSING else []
+                if isinstance(arg, dict) and "$each" in arg:
+                    items.extend(arg["$each"])
+                    if "$slice" in arg:
+                        items = items[arg["$slice"]:] if arg["$slice"] < 0 else items[:arg["$slice"]]
+                else:
+                    items.append(arg)
+                set_path(doc, path, items)
+            elif op == "$addToSet":
+                current = get_path(doc, path)
+                items = list(current) if current is not MISSING else []
+                for item in arg["$each"] if isinstance(arg, dict) and "$each" in arg else [arg]:
+                    if item not in items:
+                        items.append(item)
+                set_path(doc, path, items)
+            elif op == "$rename":
+                value = get_path(doc, path)
+                if value is not MISSING:
+                    unset_path(doc, path)
+                    set_path(doc, arg, value)
+            else:
+                raise NotImplementedError(op)
+
+
+def project(doc, projection):
+    doc = copy.deepcopy(doc)
+    if not projection:
+        return doc
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if fields and all(fields.values()):
+        projected = {}
+        for path in fields:
+            value = get_path(doc, path)
+            if value is not MISSING:
+                set_path(projected, path, value)
+        if include_id and "_id" in doc:
+            projected["_id"] = doc["_id"]
+        return projected
+    for path in fields:
+        unset_path(doc, path)
+    if not include_id:
+        doc.pop("_id", None)
+    return doc
+
+
+def _field_value(doc, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = get_path(doc, expression[1:])
+        return None if value is MISSING else value
+    return expression
+
+
+def _group(docs, spec):
+    groups = {}
+    for doc in docs:
+        key = _field_value(doc, spec["_id"])
+        group = groups.setdefault(key, {"_id": key})
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (op, expression), = accumulator.items()
+            value = _field_value(doc, expression)
+            if op == "$sum":
+                group[field] = group.get(field, 0) + value
+            elif op == "$push":
+                group.setdefault(field, []).append(value)
+            else:
+                raise NotImplementedError(op)
+    return list(groups.values())
+
+
+def _upsert_seed(query):
+    seed = {}
+    for key, condition in query.items():
+        if not key.startswith("$") and not (isinstance(condition, dict) and any(k.startswith("$") for k in condition)):
+            set_path(seed, key, copy.deepcopy(condition))
+    return seed
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self._docs = docs
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (get_path(d, field) is MISSING, get_path(d, field)), reverse=order < 0)
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def _results(self):
+        return self._docs[:self._limit] if self._limit else self._docs
+
+    async def to_list(self, length=None):
+        docs = self._results()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        self._iter = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    def __init__(self, name, unique=()):
+        self.name = name
+        self.unique = ["_id", *unique]
+        self.docs = []
+        self.indexes = []
+        # Set to an exception to make the next write fail with it
+        self.fail_next_write = None
+
+    def _maybe_fail(self):
+        if self.fail_next_write:
+            error, self.fail_next_write = self.fail_next_write, None
+            raise error
+
+    def _check_unique(self, doc, ignore=None):
+        for field in self.unique:
+            value = get_path(doc, field)
+            if value is MISSING or value is None:
+                continue
+            for other in self.docs:
+                if other is not ignore and get_path(other, field) == value:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} index: {field}_1",
+                        DUPLICATE_KEY_ERROR,
+                        {"keyPattern": {field: 1}, "keyValue": {field: value}},
+                    )
+
+    def _find(self, query):
+        return [doc for doc in self.docs if matches(doc, query)]
+
+    def find(self, query=None, projection=None, session=None, **kwargs):
+        return FakeCursor([project(doc, projection) for doc in self._find(query)])
+
+    async def find_one(self, query=None, projection=None, session=None, **kwargs):
+        found = self._find(query)
+        return project(found[0], projection) if found else None
+
+    async def count_documents(self, query, limit=0, session=None, **kwargs):
+        count = len(self._find(query))
+        return min(count, limit) if limit else count
+
+    def _insert(self, doc):
+        doc.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(doc)
+        self._check_unique(stored)
+        self.docs.append(stored)
+
+    async def insert_one(self, doc, session=None, **kwargs):
+        self._maybe_fail()
+        self._insert(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def insert_many(self, docs, ordered=True, session=None, **kwargs):
+        self._maybe_fail()
+        return await self.bulk_write([InsertOne(doc) for doc in docs], ordered=ordered)
+
+    def _update(self, query, update, upsert=False, many=False, replace=False):
+        found = self._find(query)
+        if not many:
+            found = found[:1]
+        for doc in found:
+            updated = copy.deepcopy(doc)
+            if replace:
+                updated = {"_id": doc["_id"], **copy.deepcopy(update)}
+            else:
+                apply_update(updated, update)
+            self._check_unique(updated, ignore=doc)
+            doc.clear()
+            doc.update(updated)
+        upserted_id = None
+        if not found and upsert:
+            doc = _upsert_seed(query)
+            if replace:
+                doc.update(copy.deepcopy(update))
+            else:
+                apply_update(doc, update, inserting=True)
+            self._insert(doc)
+            upserted_id = doc["_id"]
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found), upserted_id=upserted_id)
+
+    async def update_one(self, query, update, upsert=False, session=None, **kwargs):
+        self._maybe_fail()
+        return self._update(query, update, upsert=upsert)
+
+    async def update_many(self, query, update, upsert=False, session=None, **kwargs):
+        self._maybe_fail()
+        return self._update(query, update, upsert=upsert, many=True)
+
+    async def replace_one(self, query, doc, upsert=False, session=None, **kwargs):
+        self._maybe_fail()
+        return self._update(query, doc, upsert=upsert, replace=True)
+
+    async def find_one_and_update(self, query, update, projection=None, return_document=False,
+                                  upsert=False, session=None, **kwargs):
+        self._maybe_fail()
+        found = self._find(query)
+        before = copy.deepcopy(found[0]) if found else None
+        result = self._update(query, update, upsert=upsert)
+        if not return_document:
+            return project(before, projection) if before else None
+        target = {"_id": before["_id"]} if before else {"_id": result.upserted_id}
+        after = self._find(target)
+        return project(after[0], projection) if after else None
+
+    async def delete_many(self, query, session=None, **kwargs):
+        self._maybe_fail()
+        found = self._find(query)
+        removed = {id(doc) for doc in found}
+        self.docs = [doc for doc in self.docs if id(doc) not in removed]
+        return SimpleNamespace(deleted_count=len(found))
+
+    async def bulk_write(self, requests, ordered=True, session=None, **kwargs):
+        self._maybe_fail()
+        errors = []
+        inserted = 0
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    inserted += 1
+                elif isinstance(request, UpdateOne):
+                    self._update(request._filter, request._doc, upsert=request._upsert)
+                elif isinstance(request, ReplaceOne):
+                    self._update(request._filter, request._doc, upsert=request._upsert, replace=True)
+                else:
+                    raise NotImplementedError(type(request).__name__)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": e.code, "errmsg": str(e), **e.details})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": inserted})
+        return SimpleNamespace(inserted_count=inserted)
+
+    def aggregate(self, pipeline, session=None, **kwargs):
+        docs = copy.deepcopy(self.docs)
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [doc for doc in docs if matches(doc, arg)]
+            elif op == "$sort":
+                docs = FakeCursor(docs).sort(list(arg.items()))._docs
+            elif op == "$group":
+                docs = _group(docs, arg)
+            else:
+                raise OperationFailure(f"{op} is not supported by the fake collection")
+        return FakeCursor(docs)
+
+    async def create_indexes(self, models, **kwargs):
+        self.indexes.extend(models)
+
+    async def drop_index(self, name, **kwargs):
+        pass
+
+    async def index_information(self, **kwargs):
+        return {"_id_": {"key": [("_id", 1)]}, **{model.document["name"]: model.document for model in self.indexes}}
+
+
+class FakeSession:
+    operation_time = None
+    cluster_time = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def advance_cluster_time(self, cluster_time):
+        pass
+
+    def advance_operation_time(self, operation_time):
+        pass
+
+
+class FakeDatabase:
+    def __init__(self, unique=None, client=None):
+        self._unique = unique or {}
+        self._collections = {}
+        self.client = client
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self._unique.get(name, ()))
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def command(self, name, *args, **kwargs):
+        if name == "hello":
+            return {"isWritablePrimary": True}
+        return {"ok": 1}
+
+
+class FakeClient:
+    def __init__(self, unique=None):
+        self.db = FakeDatabase(unique, client=self)
+        self.closed = False
+
+    def __getitem__(self, name):
+        return self.db
+
+    async def start_session(self, **kwargs):
+        return FakeSession()
+
+    def close(self):
+        self.closed = True
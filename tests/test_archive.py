@@ -0,0 +1,150 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from archive import (
+    archive_donations, index_parts, load_archived_donations, merge_tiers, read_archived_donations,
+    record_parts, write_partition,
+)
+from tests.fakes import FakeDatabase
+
+
+def _donation(donation_id, user_id, timestamp, txn_id=None):
+    return {
+        "id": donation_id,
+        "user_id": user_id,
+        "charity_id": "c1",
+        "amount": 50.0,
+        "ripple_color": "#FFD93D",
+        "ripple_size": 5.0,
+        "status": "completed",
+        "timestamp": timestamp,
+        "txn_id": txn_id,
+    }
+
+
+def test_partitions_round_trip_with_user_filter(tmp_path):
+    write_partition(tmp_path, "2024-01", [
+        _donation("d1", "u1", "2024-01-05T10:00:00+00:00"),
+        _donation("d2", "u2", "2024-01-06T10:00:00+00:00"),
+    ])
+    # Second part file has an all-null txn_id column
+    write_partition(tmp_path, "2024-02", [_donation("d3", "u1", "2024-02-01T10:00:00+00:00", "TXN1")])
+
+    rows = read_archived_donations(tmp_path, "u1")
+    assert sorted(row["id"] for row in rows) == ["d1", "d3"]
+    assert {row["txn_id"] for row in rows} == {None, "TXN1"}
+    assert len(read_archived_donations(tmp_path)) == 3
+
+
+def test_payment_audit_fields_survive_archiving(tmp_path):
+    db = FakeDatabase()
+    db.donations.docs.append({
+        **_donation("d1", "u1", "2020-01-05T10:00:00+00:00", "pay-1"), "_id": "d1",
+        "payment_timestamp": "2020-01-05T10:00:01+00:00", "bank_txn_id": "TXN1700000000000A1B2",
+    })
+    db.donations.docs.append({
+        **_donation("d2", "u1", "2020-01-06T10:00:00+00:00"), "_id": "d2",
+        "duplicate_txn_id": "TXN1700000000000",
+    })
+    db.donations.docs[1].pop("txn_id")
+
+    asyncio.run(archive_donations(db, tmp_path, horizon_days=30))
+
+    rows = {row["id"]: row for row in read_archived_donations(tmp_path, "u1")}
+    assert db.donations.docs == []
+    assert rows["d1"]["txn_id"] == "pay-1"
+    assert rows["d1"]["bank_txn_id"] == "TXN1700000000000A1B2"
+    assert rows["d1"]["payment_timestamp"] == "2020-01-05T10:00:01+00:00"
+    assert rows["d2"]["duplicate_txn_id"] == "TXN1700000000000"
+
+
+def test_part_files_from_before_the_audit_columns_still_read(tmp_path):
+    import pandas as pd
+
+    part_dir = tmp_path / "month=2019-01"
+    part_dir.mkdir()
+    old_row = _donation("d0", "u1", "2019-01-05T10:00:00+00:00")
+    pd.DataFrame([old_row]).to_parquet(part_dir / "part-old.parquet", engine="pyarrow", index=False)
+
+    [row] = read_archived_donations(tmp_path, "u1")
+    assert row["id"] == "d0"
+    assert row["bank_txn_id"] is None and row["duplicate_txn_id"] is None
+
+
+def test_read_empty_archive(tmp_path):
+    assert read_archived_donations(tmp_path / "missing", "u1") == []
+
+
+def test_merge_tiers_prefers_hot_and_sorts_newest_first():
+    hot = [_donation("d2", "u1", "2024-03-01T00:00:00+00:00")]
+    archived = [
+        _donation("d1", "u1", "2024-01-01T00:00:00+00:00"),
+        _donation("d2", "u1", "2024-03-01T00:00:00+00:00", "stale"),
+    ]
+    merged = merge_tiers(hot, archived, limit=10)
+    assert [d["id"] for d in merged] == ["d2", "d1"]
+    assert merged[0]["txn_id"] is None
+    assert len(merge_tiers(hot, archived, limit=1)) == 1
+
+
+def test_merge_tiers_drops_donations_archived_twice(tmp_path):
+    # A run that stopped between writing and deleting archives the batch again
+    for _ in range(2):
+        write_partition(tmp_path, "2024-01", [_donation("d1", "u1", "2024-01-05T10:00:00+00:00")])
+    archived = read_archived_donations(tmp_path, "u1")
+    assert [d["id"] for d in archived] == ["d1", "d1"]
+    assert [d["id"] for d in merge_tiers([], archived)] == ["d1"]
+
+
+def test_archive_donations_moves_only_old_drained_completed_donations(tmp_path):
+    db = FakeDatabase()
+    old = "2020-01-05T10:00:00+00:00"
+    recent = datetime.now(timezone.utc).isoformat()
+    db.donations.docs.extend([
+        {**_donation("d1", "u1", old), "_id": "d1"},
+        {**_donation("d2", "u2", "2020-02-05T10:00:00+00:00"), "_id": "d2"},
+        {**_donation("d3", "u1", recent), "_id": "d3"},
+        {**_donation("d4", "u1", old), "_id": "d4", "status": "pending"},
+        # Side effects not yet applied by the outbox worker
+        {**_donation("d5", "u1", old), "_id": "d5", "outbox": {"key": "d5:p"}},
+    ])
+
+    stats = asyncio.run(archive_donations(db, tmp_path, horizon_days=365, batch_size=1))
+
+    assert stats == {"archived": 2, "files": 2}
+    assert sorted(d["_id"] for d in db.donations.docs) == ["d3", "d4", "d5"]
+    assert sorted(d["id"] for d in read_archived_donations(tmp_path)) == ["d1", "d2"]
+    assert sorted(p.parent.name for p in tmp_path.glob("month=*/*.parquet")) == ["month=2020-01", "month=2020-02"]
+    parts = {entry["_id"]: entry["parts"] for entry in db.archive_parts.docs}
+    assert sorted(parts) == ["u1", "u2"]
+    assert [part.split("/")[0] for part in parts["u1"]] == ["month=2020-01"]
+
+
+def test_user_reads_only_open_indexed_part_files(tmp_path):
+    db = FakeDatabase()
+    indexed = write_partition(tmp_path, "2024-01", [_donation("d1", "u1", "2024-01-05T10:00:00+00:00")])
+    # Not in the index, so a timeline read never opens it
+    write_partition(tmp_path, "2024-02", [_donation("d2", "u1", "2024-02-05T10:00:00+00:00")])
+    asyncio.run(record_parts(db, {"u1": [indexed.relative_to(tmp_path).as_posix()]}))
+
+    rows = asyncio.run(load_archived_donations(db, tmp_path, "u1"))
+    assert [row["id"] for row in rows] == ["d1"]
+    assert asyncio.run(load_archived_donations(db, tmp_path, "u2")) == []
+
+
+def test_index_parts_rebuilds_the_index_from_disk(tmp_path):
+    db = FakeDatabase()
+    write_partition(tmp_path, "2024-01", [
+        _donation("d1", "u1", "2024-01-05T10:00:00+00:00"),
+        _donation("d2", "u2", "2024-01-06T10:00:00+00:00"),
+    ])
+    write_partition(tmp_path, "2024-02", [_donation("d3", "u1", "2024-02-01T10:00:00+00:00")])
+
+    assert asyncio.run(index_parts(db, tmp_path)) == 2
+    rows = asyncio.run(load_archived_donations(db, tmp_path, "u1"))
+    assert sorted(row["id"] for row in rows) == ["d1", "d3"]
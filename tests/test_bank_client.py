@@ -0,0 +1,137 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+from bank import BankClient, BankUnavailableError, CircuitBreaker, CircuitOpenError
+
+
+def _bank(handler, **kwargs):
+    return BankClient("http://bank.test", transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_concurrent_checks_share_one_bulk_call():
+    calls = []
+
+    def handler(request):
+        order_ids = json.loads(request.content)["order_ids"]
+        calls.append(order_ids)
+        return httpx.Response(200, json={"status": "SUCCESS", "transactions": [
+            {"orderId": order_id, "txnId": f"TXN-{order_id}", "status": "SUCCESS"}
+            for order_id in order_ids if order_id != "missing"
+        ]})
+
+    async def main():
+        bank = _bank(handler)
+        await bank.start()
+        try:
+            return await asyncio.gather(
+                *(bank.find_transaction(f"p{i}") for i in range(10)),
+                bank.find_transaction("p3"),
+                bank.find_transaction("missing"),
+            )
+        finally:
+            await bank.close()
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(calls[0]) == sorted([f"p{i}" for i in range(10)] + ["missing"])
+    assert results[3]["txnId"] == results[10]["txnId"] == "TXN-p3"
+    assert results[-1] is None
+
+
+def test_batches_are_capped_at_max_batch():
+    calls = []
+
+    def handler(request):
+        calls.append(len(json.loads(request.content)["order_ids"]))
+        return httpx.Response(200, json={"status": "SUCCESS", "transactions": []})
+
+    async def main():
+        bank = _bank(handler, max_batch=4)
+        await bank.start()
+        try:
+            await asyncio.gather(*(bank.find_transaction(f"p{i}") for i in range(10)))
+        finally:
+            await bank.close()
+
+    asyncio.run(main())
+    assert sorted(calls) == [2, 4, 4]
+
+
+def test_circuit_opens_after_repeated_failures():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    async def main():
+        bank = _bank(handler, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        await bank.start()
+        try:
+            for _ in range(2):
+                with pytest.raises(BankUnavailableError):
+                    await bank.find_transaction("p1")
+            with pytest.raises(CircuitOpenError):
+                await bank.find_transaction("p1")
+        finally:
+            await bank.close()
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("respond", [
+    lambda: httpx.Response(200, json={"status": "SUCCESS", "transactions": None}),
+    lambda: httpx.Response(200, json=[{"orderId": "p1", "status": "SUCCESS"}]),
+    lambda: httpx.Response(200, json={"transactions": [{"txnId": "TXN1", "status": "SUCCESS"}]}),
+    lambda: httpx.Response(200, json={"transactions": ["p1"]}),
+    lambda: httpx.Response(200, content=b"<html>"),
+    lambda: (_ for _ in ()).throw(RuntimeError("transport bug")),
+], ids=["null", "list", "no-order-id", "not-a-dict", "not-json", "unexpected-error"])
+def test_malformed_responses_fail_every_caller_and_count_as_failures(respond):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()  # half-open: the next lookup is the trial call
+
+    async def main():
+        bank = _bank(lambda request: respond(), breaker=breaker)
+        await bank.start()
+        try:
+            return await asyncio.wait_for(asyncio.gather(
+                bank.find_transaction("p1"), bank.find_transaction("p2"), return_exceptions=True,
+            ), timeout=2)
+        finally:
+            await bank.close()
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, BankUnavailableError) for result in results)
+    assert breaker.failures == 2
+    # The trial is over, so another one is let through
+    assert breaker.allow() is True
+
+
+def test_half_open_breaker_allows_one_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == "half-open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+@pytest.mark.skipif(not os.getenv("BANK_URL"), reason="set BANK_URL to a running backend/server.js")
+def test_lookup_against_local_bank_server():
+    async def main():
+        bank = BankClient(os.environ["BANK_URL"])
+        await bank.start()
+        try:
+            return await bank.find_transaction("no-such-order")
+        finally:
+            await bank.close()
+
+    assert asyncio.run(main()) is None
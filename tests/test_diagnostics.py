@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import sys
+import time
+
+from diagnostics import LoopLagMonitor, ProfilingMiddleware, collapse_stack
+
+
+def test_collapse_stack_is_root_first():
+    def inner():
+        return collapse_stack(sys._getframe())
+
+    stack = inner()
+    assert stack.split(";")[-1].startswith("inner (test_diagnostics.py:")
+    assert "test_collapse_stack_is_root_first" in stack.split(";")[-2]
+
+
+def test_lag_monitor_reports_blocking_coroutine(caplog):
+    async def blocking_handler():
+        time.sleep(0.3)
+
+    async def main():
+        monitor = LoopLagMonitor(threshold_ms=50)
+        await monitor.start()
+        await asyncio.sleep(0.05)
+        await asyncio.create_task(blocking_handler(), name="slow-request")
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+        return monitor.stalls
+
+    with caplog.at_level(logging.WARNING, logger="diagnostics"):
+        stalls = asyncio.run(main())
+
+    assert stalls == 1
+    assert "slow-request" in caplog.text
+    assert "blocking_handler" in caplog.text
+
+
+async def _echo_app(scope, receive, send):
+    time.sleep(0.02)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _request(headers):
+    return {"type": "http", "method": "GET", "path": "/api/charities", "headers": headers}
+
+
+def _run(middleware, scope):
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        pass
+
+    asyncio.run(middleware(scope, receive, send))
+
+
+def _profile(mode, token=b"s3cret"):
+    return [(b"x-profile", mode), (b"x-profile-token", token)]
+
+
+def test_profiling_middleware_writes_only_when_requested(tmp_path):
+    middleware = ProfilingMiddleware(_echo_app, tmp_path, secret="s3cret")
+
+    _run(middleware, _request([]))
+    assert list(tmp_path.iterdir()) == []
+
+    _run(middleware, _request(_profile(b"sample")))
+    _run(middleware, _request(_profile(b"cprofile")))
+    suffixes = sorted(path.suffix for path in tmp_path.iterdir())
+    assert suffixes == [".folded", ".pstats"]
+
+    folded = next(tmp_path.glob("*.folded")).read_text().splitlines()
+    assert folded and all(line.rsplit(" ", 1)[1].isdigit() for line in folded)
+
+
+def test_profile_header_needs_the_secret(tmp_path):
+    _run(ProfilingMiddleware(_echo_app, tmp_path), _request(_profile(b"sample")))
+    middleware = ProfilingMiddleware(_echo_app, tmp_path, secret="s3cret")
+    _run(middleware, _request([(b"x-profile", b"sample")]))
+    _run(middleware, _request(_profile(b"cprofile", token=b"guess")))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profiles_are_capped_concurrently_and_in_total(tmp_path):
+    async def slow_app(scope, receive, send):
+        await asyncio.sleep(0.05)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    async def send(message):
+        pass
+
+    async def requests(middleware, count):
+        await asyncio.gather(*(middleware(_request(_profile(b"sample")), None, send) for _ in range(count)))
+
+    middleware = ProfilingMiddleware(slow_app, tmp_path, secret="s3cret", max_concurrent=2, max_profiles=3)
+    asyncio.run(requests(middleware, 5))
+    assert len(list(tmp_path.iterdir())) == 2
+
+    asyncio.run(requests(middleware, 5))
+    assert len(list(tmp_path.iterdir())) == 3
+    assert middleware.active == 0
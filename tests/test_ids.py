@@ -0,0 +1,171 @@
+"""Tests for UUID ``_id`` keys.
+
+The migration test runs against a local mongod (QUERY_PLAN_MONGO_URL, default
+mongodb://127.0.0.1:27017) and prints data and index sizes before and after;
+it is skipped when no mongod is reachable.
+"""
+import asyncio
+import copy
+import os
+import uuid
+
+import pytest
+
+bson = pytest.importorskip("bson")
+
+import ids
+from indexes import INDEXES
+from migrate_ids import format_report, migrate_ids, migrated, staged
+from tests.fakes import FakeDatabase
+
+MONGO_URL = os.getenv("QUERY_PLAN_MONGO_URL", "mongodb://127.0.0.1:27017")
+MIGRATION_SCALE = int(os.getenv("ID_MIGRATION_SCALE", "20000"))
+
+
+@pytest.fixture(autouse=True)
+def string_ids():
+    ids.configure()
+    yield
+    ids.configure()
+
+
+def test_documents_are_keyed_by_id_and_exposed_with_id():
+    doc = ids.to_document({"id": "abc", "name": "Asha"})
+    assert doc == {"_id": "abc", "name": "Asha"}
+    assert ids.to_api(doc) == {"id": "abc", "name": "Asha"}
+    assert ids.to_api(None) is None
+
+
+def test_binary_ids_round_trip():
+    ids.configure(binary=True)
+    value = str(uuid.uuid4())
+    stored = ids.to_db(value)
+    assert isinstance(stored, bson.Binary) and len(stored) == 16
+    assert ids.from_db(stored) == value
+    assert ids.to_api({"_id": stored}) == {"id": value}
+    # Not a UUID, so it cannot match a binary key and is left as it is
+    assert ids.to_db("nope") == "nope"
+
+
+def test_legacy_documents_keep_their_id():
+    legacy = {"_id": bson.ObjectId(), "id": "abc", "name": "Asha"}
+    assert ids.to_api(legacy) == {"id": "abc", "name": "Asha"}
+
+
+def test_legacy_fallback_filters():
+    assert ids.id_filter("abc") == {"_id": "abc"}
+    assert ids.ids_filter(["a", "b"]) == {"_id": {"$in": ["a", "b"]}}
+
+    ids.configure(legacy_fallback=True)
+    assert ids.id_filter("abc") == {"$or": [{"_id": "abc"}, {"id": "abc"}]}
+    assert ids.ids_filter(iter(["a"])) == {"$or": [{"_id": {"$in": ["a"]}}, {"id": {"$in": ["a"]}}]}
+
+
+def test_format_report_shows_relative_change():
+    report = {"users": {"migrated": 2, "before": {"count": 2, "total_index_size": 200},
+                        "after": {"count": 2, "total_index_size": 150}}}
+    text = format_report(report)
+    assert "users: 2 documents migrated" in text
+    assert "total_index_size: 200 -> 150 (-25.0%)" in text
+
+
+def _legacy_donation(amount, **fields):
+    return {"_id": bson.ObjectId(), "id": str(uuid.uuid4()), "status": "completed", "amount": amount, **fields}
+
+
+def _migrate_standalone(db, **kwargs):
+    return asyncio.run(migrate_ids(db, collections=["donations"], **kwargs))["donations"]
+
+
+def test_standalone_migration_keeps_unique_txn_ids():
+    db = FakeDatabase(unique={"donations": ["txn_id"]})
+    donations = [_legacy_donation(float(i), txn_id=f"pay-{i}") for i in range(5)] + [_legacy_donation(5.0)]
+    db.donations.docs.extend(copy.deepcopy(donations))
+
+    assert _migrate_standalone(db, batch_size=2)["migrated"] == len(donations)
+
+    stored = {doc["_id"]: doc for doc in db.donations.docs}
+    assert len(stored) == len(donations)
+    for donation in donations:
+        assert stored[donation["id"]] == migrated(donation)
+
+
+def test_standalone_migration_resumes_after_an_interrupted_run():
+    db = FakeDatabase(unique={"donations": ["txn_id"]})
+    # Copied but not deleted yet, with a copy older than the original
+    pending = _legacy_donation(10.0, txn_id="pay-1")
+    stale_copy = {**staged(migrated(pending), "donations"), "amount": 0.0}
+    # Deleted, but its copy still holds txn_id under the staging name
+    deleted = _legacy_donation(20.0, txn_id="pay-2")
+    db.donations.docs.extend([copy.deepcopy(pending), stale_copy, staged(migrated(deleted), "donations")])
+
+    assert _migrate_standalone(db)["migrated"] == 1
+
+    assert sorted(db.donations.docs, key=lambda d: d["amount"]) == [migrated(pending), migrated(deleted)]
+
+
+def test_standalone_migration_keeps_originals_it_could_not_copy():
+    db = FakeDatabase(unique={"donations": ["txn_id", "receipt"]})
+    db.donations.docs.append({"_id": str(uuid.uuid4()), "receipt": "R1"})
+    ok = _legacy_donation(1.0, txn_id="pay-1")
+    clashing = _legacy_donation(2.0, txn_id="pay-2", receipt="R1")
+    db.donations.docs.extend(copy.deepcopy([clashing, ok]))
+
+    with pytest.raises(RuntimeError):
+        _migrate_standalone(db)
+
+    stored = {doc["_id"]: doc for doc in db.donations.docs}
+    assert stored[clashing["_id"]] == clashing
+    assert stored[ok["id"]] == migrated(ok)
+
+
+@pytest.fixture
+def legacy_db():
+    pymongo = pytest.importorskip("pymongo")
+    motor = pytest.importorskip("motor.motor_asyncio")
+    client = pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod reachable at {MONGO_URL}")
+
+    db_name = f"hopeorb_ids_{uuid.uuid4().hex[:8]}"
+    db = client[db_name]
+    donations = [{"id": str(uuid.uuid4()), "user_id": str(uuid.uuid4()), "charity_id": "c1",
+                  "amount": float(i % 500), "status": "completed", "timestamp": f"2025-01-01T00:00:{i % 60:02d}"}
+                 for i in range(MIGRATION_SCALE)]
+    # Verified payments hold a unique txn_id that each copy takes over from its original
+    for i, donation in enumerate(donations[::2]):
+        donation["txn_id"] = f"pay-{i}"
+    db.donations.insert_many(donations)
+    db.donations.create_indexes(INDEXES["donations"])
+    db.donations.create_index("id", name="id_1", unique=True)
+
+    motor_client = motor.AsyncIOMotorClient(MONGO_URL)
+    yield motor_client[db_name], db, donations
+    motor_client.close()
+    client.drop_database(db_name)
+    client.close()
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_migration_moves_ids_and_shrinks_indexes(legacy_db, binary):
+    motor_db, db, donations = legacy_db
+    ids.configure(binary=binary)
+
+    report = asyncio.run(migrate_ids(motor_db, collections=["donations"], drop_legacy_indexes=True))
+    print(format_report(report))
+
+    result = report["donations"]
+    assert result["migrated"] == len(donations)
+    assert db.donations.count_documents({}) == len(donations)
+    assert db.donations.count_documents({"id": {"$exists": True}}) == 0
+    assert db.donations.count_documents({"txn_id": {"$type": "string"}}) == len(donations[::2])
+    assert db.donations.count_documents({"migrating_txn_id": {"$exists": True}}) == 0
+    assert "id_1" not in db.donations.index_information()
+
+    sample = donations[123]
+    stored = db.donations.find_one({"_id": ids.to_db(sample["id"])})
+    assert ids.to_api(stored)["id"] == sample["id"]
+    assert stored["amount"] == sample["amount"]
+    assert result["after"]["total_index_size"] < result["before"]["total_index_size"]
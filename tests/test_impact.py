@@ -0,0 +1,124 @@
+"""Impact summary tests.
+
+The update-pipeline tests run against a local mongod (QUERY_PLAN_MONGO_URL,
+default mongodb://127.0.0.1:27017) and are skipped when none is reachable.
+"""
+import os
+import threading
+import uuid
+
+import pytest
+
+from impact import current_streak, impact_summary_init, impact_update, summarize
+
+MONGO_URL = os.getenv("QUERY_PLAN_MONGO_URL", "mongodb://127.0.0.1:27017")
+
+
+def _donation(charity_id, amount, timestamp, outbox_key=None):
+    donation = {"id": f"d-{timestamp}", "user_id": "u1", "charity_id": charity_id,
+                "amount": amount, "timestamp": timestamp}
+    if outbox_key:
+        donation["outbox"] = {"key": outbox_key}
+    return donation
+
+
+def test_summarize_totals_and_streak():
+    summary = summarize("u1", [
+        _donation("c2", 20.0, "2024-05-03T09:00:00+00:00"),
+        _donation("c1", 50.0, "2024-05-01T09:00:00+00:00"),
+        _donation("c1", 30.0, "2024-05-02T18:00:00+00:00"),
+        _donation("c1", 10.0, "2024-05-03T20:00:00+00:00", outbox_key="d:p"),
+    ])
+    assert summary["total_amount"] == 110.0
+    assert summary["donation_count"] == 4
+    assert summary["per_charity"] == {"c1": {"amount": 90.0, "count": 3},
+                                      "c2": {"amount": 20.0, "count": 1}}
+    assert summary["first_donation_at"] == "2024-05-01T09:00:00+00:00"
+    assert summary["last_donation_at"] == "2024-05-03T20:00:00+00:00"
+    assert summary["streak_days"] == 3
+    assert summary["outbox_keys"] == ["d:p"]
+
+
+def test_streak_resets_after_a_gap():
+    summary = summarize("u1", [
+        _donation("c1", 10.0, "2024-05-01T09:00:00+00:00"),
+        _donation("c1", 10.0, "2024-05-02T09:00:00+00:00"),
+        _donation("c1", 10.0, "2024-05-05T09:00:00+00:00"),
+    ])
+    assert summary["streak_days"] == 1
+
+
+def test_current_streak_expires_after_a_missed_day():
+    summary = {"last_donation_day": "2024-05-03", "streak_days": 4}
+    assert current_streak(summary, today="2024-05-03") == 4
+    assert current_streak(summary, today="2024-05-04") == 4
+    assert current_streak(summary, today="2024-05-05") == 0
+    assert current_streak({}, today="2024-05-05") == 0
+
+
+
+@pytest.fixture
+def user_impact():
+    pymongo = pytest.importorskip("pymongo")
+    from indexes import INDEXES
+
+    client = pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod reachable at {MONGO_URL}")
+    db_name = f"hopeorb_impact_{uuid.uuid4().hex[:8]}"
+    collection = client[db_name].user_impact
+    collection.create_indexes(INDEXES["user_impact"])
+    yield collection
+    client.drop_database(db_name)
+    client.close()
+
+
+def _fold(collection, donation, key):
+    from pymongo.errors import BulkWriteError
+
+    # As in outbox.py: a concurrent creation of the same summary is harmless
+    try:
+        collection.bulk_write([impact_summary_init(donation["user_id"])])
+    except BulkWriteError as e:
+        assert all(err["code"] == 11000 for err in e.details["writeErrors"])
+    return collection.bulk_write([impact_update(donation, key)])
+
+
+def test_pipeline_update_matches_rebuilt_summary(user_impact):
+    donations = [
+        _donation("c1", 50.0, "2024-05-01T09:00:00+00:00"),
+        _donation("c1", 30.0, "2024-05-02T18:00:00+00:00"),
+        _donation("c2", 20.0, "2024-05-03T09:00:00+00:00"),
+        _donation("c1", 10.0, "2024-05-03T20:00:00+00:00"),
+    ]
+    for donation in donations:
+        _fold(user_impact, donation, donation["id"])
+    # Applying a key again changes nothing
+    assert _fold(user_impact, donations[0], donations[0]["id"]).matched_count == 0
+
+    stored = user_impact.find_one({"user_id": "u1"}, {"_id": 0})
+    expected = summarize("u1", donations)
+    for field in ("total_amount", "donation_count", "per_charity", "first_donation_at",
+                  "last_donation_at", "last_donation_day", "streak_days"):
+        assert stored[field] == expected[field], field
+
+
+def test_concurrent_first_donations_of_a_new_donor_are_all_counted(user_impact):
+    donations = [_donation("c1", 10.0, f"2024-05-01T09:00:{i:02d}+00:00") for i in range(8)]
+    barrier = threading.Barrier(len(donations))
+
+    def fold(donation):
+        barrier.wait()
+        _fold(user_impact, donation, donation["id"])
+
+    threads = [threading.Thread(target=fold, args=(d,)) for d in donations]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stored = user_impact.find_one({"user_id": "u1"})
+    assert stored["donation_count"] == len(donations)
+    assert stored["total_amount"] == 80.0
@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from indexes import INDEXES, TXN_ID_INDEX, ensure_indexes
+from tests.fakes import FakeDatabase
+
+
+def _donation(donation_id, txn_id, timestamp):
+    return {"_id": donation_id, "status": "completed", "txn_id": txn_id, "timestamp": timestamp}
+
+
+def test_duplicate_txn_ids_are_resolved_before_the_unique_index_is_built():
+    db = FakeDatabase()
+    db.donations.docs.extend([
+        _donation("late", "TXN1700000000000", "2024-01-02T00:00:00"),
+        _donation("early", "TXN1700000000000", "2024-01-01T00:00:00"),
+        _donation("other", "TXN1700000000001", "2024-01-03T00:00:00"),
+        {"_id": "pending", "status": "pending"},
+    ])
+
+    asyncio.run(ensure_indexes(db))
+
+    by_id = {d["_id"]: d for d in db.donations.docs}
+    assert by_id["early"]["txn_id"] == "TXN1700000000000"
+    assert "txn_id" not in by_id["late"]
+    assert by_id["late"]["duplicate_txn_id"] == "TXN1700000000000"
+    assert by_id["other"]["txn_id"] == "TXN1700000000001"
+    assert [m.document["name"] for m in db.donations.indexes] == [m.document["name"] for m in INDEXES["donations"]]
+
+
+def test_duplicates_are_not_searched_once_the_index_exists():
+    db = FakeDatabase()
+    asyncio.run(ensure_indexes(db))
+    assert TXN_ID_INDEX in asyncio.run(db.donations.index_information())
+
+    def unexpected_scan(*args, **kwargs):
+        raise AssertionError("txn_id_1 already rejects duplicates")
+
+    db.donations.aggregate = unexpected_scan
+    asyncio.run(ensure_indexes(db))
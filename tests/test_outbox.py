@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from pymongo import UpdateOne
+
+import outbox
+from outbox import APPLIED_KEYS_KEPT, OutboxWorker, new_outbox_record
+from tests.fakes import FakeDatabase
+
+
+@pytest.fixture(autouse=True)
+def simple_impact_update(monkeypatch):
+    # The real update is an aggregation pipeline, which needs a mongod (see test_impact.py)
+    monkeypatch.setattr(outbox, "impact_update", lambda d, key: UpdateOne(
+        {"user_id": d["user_id"]}, {"$inc": {"total_amount": d["amount"]}}
+    ))
+
+
+def _db():
+    db = FakeDatabase()
+    db.charities.docs.append({"_id": "c1", "current_amount": 0.0})
+    db.users.docs.append({"_id": "u1", "hope_points": 0})
+    return db
+
+
+def _verified(db, donation_id, amount=100.0, **outbox_fields):
+    record = {**new_outbox_record(donation_id, f"pay-{donation_id}"), **outbox_fields}
+    db.donations.docs.append({
+        "_id": donation_id, "user_id": "u1", "charity_id": "c1", "amount": amount,
+        "status": "completed", "outbox": record,
+    })
+
+
+def _run(worker):
+    async def drain():
+        batch = await worker._claim_batch()
+        if batch:
+            await worker._process(batch)
+        return batch
+    return asyncio.run(drain())
+
+
+def _donation(db, donation_id):
+    return next(d for d in db.donations.docs if d["_id"] == donation_id)
+
+
+def test_claim_leases_due_and_expired_records_only():
+    db = _db()
+    past = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+    future = (datetime.now(timezone.utc) + timedelta(minutes=5)).isoformat()
+    _verified(db, "due")
+    _verified(db, "expired-lease", state="processing", available_at=past)
+    _verified(db, "leased", state="processing", available_at=future)
+    _verified(db, "backing-off", available_at=future)
+    _verified(db, "failed", state="failed", available_at=past)
+
+    batch = asyncio.run(OutboxWorker(db, batch_size=10)._claim_batch())
+
+    assert sorted(d["id"] for d in batch) == ["due", "expired-lease"]
+    for d in batch:
+        stored = _donation(db, d["id"])["outbox"]
+        assert stored["state"] == "processing"
+        assert stored["attempts"] == 1
+        assert stored["available_at"] > datetime.now(timezone.utc).isoformat()
+
+
+def test_claim_skips_records_another_worker_leased_meanwhile():
+    db = _db()
+    for donation_id in ("d1", "d2", "d3"):
+        _verified(db, donation_id)
+    lease_all = db.donations.update_many
+
+    async def other_worker_first(query, update, **kwargs):
+        # Another worker leases d1 between this worker's candidate read and its update
+        db.donations.docs[0]["outbox"].update(state="processing", available_at="9999", lease="other")
+        return await lease_all(query, update, **kwargs)
+
+    db.donations.update_many = other_worker_first
+    batch = asyncio.run(OutboxWorker(db, batch_size=2)._claim_batch())
+
+    assert [d["id"] for d in batch] == ["d2"]
+    assert _donation(db, "d1")["outbox"]["lease"] == "other"
+    assert _donation(db, "d3")["outbox"]["state"] == "pending"
+
+
+def test_process_applies_every_effect_and_clears_the_outbox():
+    db = _db()
+    _verified(db, "d1", amount=120.0)
+
+    _run(OutboxWorker(db))
+
+    assert db.charities.docs[0]["current_amount"] == 120.0
+    assert db.users.docs[0]["hope_points"] == 12
+    assert db.user_impact.docs[0]["total_amount"] == 120.0
+    assert [n["_id"] for n in db.notifications.docs] == ["d1:pay-d1"]
+    assert "outbox" not in _donation(db, "d1")
+
+
+def test_retry_after_partial_failure_only_reruns_failed_effects():
+    db = _db()
+    _verified(db, "d1", amount=50.0)
+    db.users.fail_next_write = RuntimeError("primary stepped down")
+
+    _run(OutboxWorker(db))
+
+    record = _donation(db, "d1")["outbox"]
+    assert record["state"] == "pending"
+    assert record["applied"] == ["charity", "impact", "notification"]
+    assert record["available_at"] > datetime.now(timezone.utc).isoformat()
+    assert db.charities.docs[0]["current_amount"] == 50.0
+
+    # Far more donations than the per-document key window reach the charity meanwhile
+    charity = db.charities.docs[0]
+    charity["outbox_keys"] = [f"other-{i}" for i in range(APPLIED_KEYS_KEPT)]
+    record["available_at"] = datetime.now(timezone.utc).isoformat()
+
+    _run(OutboxWorker(db))
+
+    assert charity["current_amount"] == 50.0
+    assert db.users.docs[0]["hope_points"] == 5
+    assert db.user_impact.docs[0]["total_amount"] == 50.0
+    assert len(db.notifications.docs) == 1
+    assert "outbox" not in _donation(db, "d1")
+
+
+def test_already_inserted_notification_counts_as_applied():
+    db = _db()
+    _verified(db, "d1")
+    db.notifications.docs.append({"_id": "d1:pay-d1"})
+
+    _run(OutboxWorker(db))
+
+    assert "outbox" not in _donation(db, "d1")
+
+
+def test_record_fails_after_max_attempts():
+    db = _db()
+    _verified(db, "d1", attempts=2)
+    db.charities.fail_next_write = RuntimeError("boom")
+
+    _run(OutboxWorker(db, max_attempts=3))
+
+    record = _donation(db, "d1")["outbox"]
+    assert record["state"] == "failed"
+    assert record["attempts"] == 3
+    assert "charity" not in record["applied"]
+    # A failed record is never claimed again
+    assert _run(OutboxWorker(db)) == []
+
+
+def test_started_worker_drains_on_notify():
+    db = _db()
+
+    async def scenario():
+        worker = OutboxWorker(db, poll_interval=60)
+        await worker.start()
+        _verified(db, "d1")
+        worker.notify()
+        for _ in range(100):
+            if "outbox" not in _donation(db, "d1"):
+                break
+            await asyncio.sleep(0.01)
+        await worker.stop()
+
+    asyncio.run(scenario())
+    assert "outbox" not in _donation(db, "d1")
+    assert db.charities.docs[0]["current_amount"] == 100.0
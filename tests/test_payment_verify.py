@@ -0,0 +1,234 @@
+"""Route tests for ``/api/payment/verify`` against in-memory collections.
+
+The end-to-end test pays at the Node bank stand-in (backend/server.js, set
+BANK_URL to it) and verifies against a local mongod (QUERY_PLAN_MONGO_URL,
+default mongodb://127.0.0.1:27017); it is skipped when either is missing.
+"""
+import os
+import time
+import uuid
+
+import pytest
+
+fastapi_testclient = pytest.importorskip("fastapi.testclient")
+pytest.importorskip("motor")
+
+import ids
+import server
+from replay import ReplayGuard
+from tests.fakes import FakeClient
+
+BANK_URL = os.getenv("BANK_URL")
+MONGO_URL = os.getenv("QUERY_PLAN_MONGO_URL", "mongodb://127.0.0.1:27017")
+
+
+class StubBank:
+    def __init__(self, transactions=None):
+        self.transactions = transactions or {}
+
+    async def find_transaction(self, order_id):
+        return self.transactions.get(order_id)
+
+
+class StubWorker:
+    notifications = 0
+
+    def notify(self):
+        self.notifications += 1
+
+
+@pytest.fixture
+def api():
+    ids.configure()
+    client = FakeClient(unique={"donations": ["txn_id"]})
+    app = server.create_app(server.Settings(mongo_url="mongodb://fake", db_name="fake"))
+    # The lifespan is not run; the state it would open is set up by hand
+    app.state.client = client
+    app.state.db = app.state.secondary_db = client.db
+    app.state.replay_guard = ReplayGuard(capacity=1000)
+    app.state.bank = None
+    app.state.outbox_worker = StubWorker()
+    client.db.donations.docs.append({"_id": "d1", "user_id": "u1", "charity_id": "c1",
+                                     "amount": 250.0, "status": "pending"})
+    return fastapi_testclient.TestClient(app), app
+
+
+def _verify(http, donation_id="d1", payment_id="pay-1"):
+    return http.post("/api/payment/verify", json={"donation_id": donation_id, "payment_id": payment_id})
+
+
+def _donation(app, donation_id="d1"):
+    return next(d for d in app.state.db.donations.docs if d["_id"] == donation_id)
+
+
+def test_bank_confirmed_payment_completes_the_donation(api):
+    http, app = api
+    app.state.bank = StubBank({"pay-1": {"txnId": "B1", "donationId": "d1", "amount": "250.00"}})
+
+    response = _verify(http)
+
+    assert response.status_code == 200
+    assert _donation(app)["status"] == "completed"
+    assert _donation(app)["bank_txn_id"] == "B1"
+    assert app.state.outbox_worker.notifications == 1
+
+
+@pytest.mark.parametrize("bank_txn", [
+    None,
+    {"txnId": "B1", "donationId": "d2", "amount": 250.0},
+    {"txnId": "B1", "donationId": "d1", "amount": 1.0},
+    {"txnId": "B1", "amount": 1.0},
+    {"txnId": "B1", "donationId": "d1"},
+])
+def test_payment_the_bank_does_not_confirm_for_this_donation_is_rejected(api, bank_txn):
+    http, app = api
+    app.state.bank = StubBank({"pay-1": bank_txn})
+
+    assert _verify(http).status_code == 402
+    assert _donation(app)["status"] == "pending"
+    assert app.state.outbox_worker.notifications == 0
+
+
+def test_bank_check_needs_an_existing_donation(api):
+    http, app = api
+    app.state.bank = StubBank({"pay-1": {"txnId": "B1", "amount": 250.0}})
+
+    assert _verify(http, donation_id="missing").status_code == 404
+
+
+def test_recent_replay_is_answered_from_memory(api):
+    http, app = api
+    app.state.replay_guard.remember("pay-1", "d1")
+    app.state.db.donations.fail_next_write = AssertionError("a remembered replay must not write")
+
+    response = _verify(http)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Payment already verified"
+    assert _verify(http, donation_id="d2").status_code == 409
+    assert app.state.outbox_worker.notifications == 0
+
+
+def test_bloom_hit_is_confirmed_in_mongo(api):
+    http, app = api
+    app.state.db.donations.docs.append({"_id": "d0", "status": "completed", "txn_id": "pay-1"})
+    app.state.replay_guard.bloom.add("pay-1")
+
+    assert _verify(http, donation_id="d0").json()["message"] == "Payment already verified"
+    assert _verify(http).status_code == 409
+    assert _donation(app)["status"] == "pending"
+    # Confirmed replays are remembered exactly from then on
+    assert app.state.replay_guard.verified_donation("pay-1") == "d0"
+
+
+def test_bloom_false_positive_still_verifies(api):
+    http, app = api
+    app.state.replay_guard.bloom.add("pay-1")
+
+    assert _verify(http).json()["message"] == "Payment verified successfully"
+    assert _donation(app)["txn_id"] == "pay-1"
+
+
+def test_payment_used_by_another_donation_conflicts_on_the_unique_index(api):
+    http, app = api
+    # Stored by another process, so neither the LRU nor the Bloom filter knows it
+    app.state.db.donations.docs.append({"_id": "d0", "status": "completed", "txn_id": "pay-1"})
+
+    response = _verify(http)
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Payment already used for another donation"
+    assert _donation(app)["status"] == "pending"
+
+
+def test_donation_completed_with_another_payment_conflicts(api):
+    http, app = api
+    assert _verify(http, payment_id="pay-1").status_code == 200
+
+    response = _verify(http, payment_id="pay-2")
+
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Donation already completed with another payment"
+    assert _donation(app)["txn_id"] == "pay-1"
+
+
+def test_replay_of_the_same_payment_is_acknowledged_once(api):
+    http, app = api
+    assert _verify(http).json()["message"] == "Payment verified successfully"
+    # Another instance verified it, so this one has no memory of the payment
+    app.state.replay_guard = ReplayGuard(capacity=1000)
+
+    response = _verify(http)
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Payment already verified"
+    assert app.state.outbox_worker.notifications == 1
+
+
+@pytest.fixture
+def bank_app():
+    if not BANK_URL:
+        pytest.skip("set BANK_URL to a running backend/server.js")
+    pymongo = pytest.importorskip("pymongo")
+    client = pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod reachable at {MONGO_URL}")
+
+    db_name = f"hopeorb_bank_{uuid.uuid4().hex[:8]}"
+    settings = server.Settings(mongo_url=MONGO_URL, db_name=db_name, bank_url=BANK_URL,
+                               outbox_workers=1, read_max_staleness_seconds=0)
+    with fastapi_testclient.TestClient(server.create_app(settings)) as http:
+        yield http
+    client.drop_database(db_name)
+    client.close()
+
+
+def _pay_at_bank(donation, payment_id, amount):
+    import httpx
+
+    response = httpx.post(f"{BANK_URL}/api/payment/verify", json={
+        "donation_id": donation["id"], "payment_id": payment_id,
+        "upi_id": "mrunal@upi", "pin": "1111", "amount": amount,
+    })
+    assert response.json()["success"], response.json()
+
+
+def test_bank_paid_donation_is_completed_by_the_platform_once(bank_app):
+    http = bank_app
+    http.post("/api/init-charities")
+    charity = http.get("/api/charities").json()[0]
+    user = http.post("/api/register", json={"name": "Bank Donor", "email": f"{uuid.uuid4().hex}@example.com"}).json()
+    donation = http.post("/api/donations", json={"user_id": user["id"], "charity_id": charity["id"],
+                                                 "amount": 10}).json()
+    payment_id = str(uuid.uuid4())
+    _pay_at_bank(donation, payment_id, 10)
+
+    assert _verify(http, donation["id"], payment_id).json()["message"] == "Payment verified successfully"
+    assert _verify(http, donation["id"], payment_id).json()["message"] == "Payment already verified"
+
+    # The outbox applies the side effects the bank server no longer writes itself
+    for _ in range(100):
+        impact = http.get(f"/api/user/{user['id']}/impact").json()
+        hope_points = http.get(f"/api/user/{user['id']}").json()["hope_points"]
+        if impact["donation_count"] and hope_points:
+            break
+        time.sleep(0.05)
+    assert impact["total_amount"] == 10
+    assert hope_points == 1
+    current = next(c for c in http.get("/api/charities").json() if c["id"] == charity["id"])
+    assert current["current_amount"] == charity["current_amount"] + 10
+
+
+def test_underpaid_bank_payment_is_rejected(bank_app):
+    http = bank_app
+    http.post("/api/init-charities")
+    charity_id = http.get("/api/charities").json()[0]["id"]
+    user = http.post("/api/register", json={"name": "Bank Donor", "email": f"{uuid.uuid4().hex}@example.com"}).json()
+    donation = http.post("/api/donations", json={"user_id": user["id"], "charity_id": charity_id,
+                                                 "amount": 20}).json()
+    payment_id = str(uuid.uuid4())
+    _pay_at_bank(donation, payment_id, 5)
+
+    assert _verify(http, donation["id"], payment_id).status_code == 402
@@ -0,0 +1,326 @@
+"""Query-plan regression tests for every query issued by backend/server.py.
+
+Runs against a local mongod (QUERY_PLAN_MONGO_URL, default
+mongodb://127.0.0.1:27017) seeded with QUERY_PLAN_SCALE synthetic donations.
+The routes are driven through the app while a command listener records what
+they send; each recorded command is then explain()ed and must be an index
+scan that examines only the documents it needs, so a route change cannot
+silently turn into a collection scan. Skipped when no mongod is reachable.
+Lookups by ID go through the built-in _id index (see backend/ids.py).
+"""
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+
+from pymongo import monitoring
+
+import ids
+from indexes import INDEXES
+
+MONGO_URL = os.getenv("QUERY_PLAN_MONGO_URL", "mongodb://127.0.0.1:27017")
+DB_NAME = os.getenv("QUERY_PLAN_DB_NAME", "hopeorb_query_plans")
+SCALE = int(os.getenv("QUERY_PLAN_SCALE", "20000"))
+SEED_BATCH = 5000
+# Highest tolerated docsExamined / nReturned for point and range queries
+MAX_DOCS_RATIO = 1.0
+
+STATUSES = ["completed"] * 8 + ["pending", "failed"]
+# Point lookups on _id skip the planner: IDHACK, or EXPRESS_IXSCAN from MongoDB 8.0
+ID_LOOKUP_STAGES = {"IDHACK", "EXPRESS_IXSCAN"}
+# Commands the outbox worker may claim records with
+CLAIM_COMMANDS = ("findAndModify", "update", "find")
+# Session, transaction and routing fields a recorded command carries that explain() rejects
+NOT_EXPLAINED = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern",
+                 "$db", "$clusterTime", "$readPreference"}
+
+
+def _chunks(docs, size=SEED_BATCH):
+    for start in range(0, len(docs), size):
+        yield docs[start:start + size]
+
+
+def _seed(db, scale):
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+
+    charities = [{"id": str(uuid.uuid4()), "name": f"Charity {i}", "description": "",
+                  "charity_type": "emergency", "goal": 1e5, "current_amount": 0.0,
+                  "visual_type": "tree"} for i in range(6)]
+    users = [{"id": str(uuid.uuid4()), "name": f"User {i}", "email": f"user{i}@example.com",
+              "initials": "US", "avatar_color": "#FF6B9D", "emotion": "neutral",
+              "hope_points": 0, "created_at": now.isoformat()}
+             for i in range(max(10, scale // 20))]
+
+    donations = []
+    for _ in range(scale):
+        status = rng.choice(STATUSES)
+        donations.append({
+            "id": str(uuid.uuid4()),
+            "user_id": rng.choice(users)["id"],
+            "charity_id": rng.choice(charities)["id"],
+            "amount": float(rng.randint(10, 1000)),
+            "ripple_color": "#4ECDC4",
+            "ripple_size": 5.0,
+            "status": status,
+            "timestamp": (now - timedelta(minutes=rng.randint(0, 525600))).isoformat(),
+        })
+    for donation in donations[:max(1, scale // 100)]:
+        donation["outbox"] = {"key": f"{donation['id']}:p", "state": "pending", "attempts": 0,
+                              "available_at": now.isoformat(), "created_at": now.isoformat()}
+
+    audio = [{"id": str(uuid.uuid4()), "user_id": d["user_id"], "donation_id": d["id"],
+              "audio_data": "UklGRg==", "duration": 3.0, "created_at": now.isoformat()}
+             for d in donations[::10]]
+
+    db.charities.insert_many([ids.to_document(c) for c in charities])
+    for collection, docs in (("users", users), ("donations", donations), ("audio_messages", audio)):
+        for chunk in _chunks(docs):
+            db[collection].insert_many([ids.to_document(d) for d in chunk], ordered=False)
+
+    for collection, models in INDEXES.items():
+        db[collection].create_indexes(models)
+    return {"users": users, "charities": charities, "donations": donations}
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    client = pymongo.MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip(f"no mongod reachable at {MONGO_URL}")
+
+    client.drop_database(DB_NAME)
+    db = client[DB_NAME]
+    data = _seed(db, SCALE)
+    yield db, data
+    client.drop_database(DB_NAME)
+    client.close()
+
+
+def _find(key, value):
+    """Depth-first search for ``key`` anywhere in an explain document"""
+    if isinstance(value, dict):
+        if key in value:
+            return value[key]
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            found = _find(key, item)
+            if found is not None:
+                return found
+    return None
+
+
+def _stages(plan):
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        plan = list(plan.values())
+    if isinstance(plan, list):
+        for item in plan:
+            stages.extend(_stages(item))
+    return stages
+
+
+class CommandRecorder(monitoring.CommandListener):
+    """Keeps every command the app's client starts"""
+
+    def __init__(self):
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self.commands.append(dict(event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def since(self, start=0):
+        with self._lock:
+            return self.commands[start:]
+
+
+@pytest.fixture(scope="module")
+def api(seeded, tmp_path_factory):
+    fastapi_testclient = pytest.importorskip("fastapi.testclient")
+    motor = pytest.importorskip("motor.motor_asyncio")
+    import server
+
+    recorder = CommandRecorder()
+    settings = server.Settings(mongo_url=MONGO_URL, db_name=DB_NAME, outbox_workers=1,
+                               archive_dir=tmp_path_factory.mktemp("archive"))
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(server, "AsyncIOMotorClient",
+                      lambda url, **kwargs: motor.AsyncIOMotorClient(url, event_listeners=[recorder], **kwargs))
+        with fastapi_testclient.TestClient(server.create_app(settings)) as http:
+            yield http, recorder
+
+
+def _targets(command, name, collection):
+    return next(iter(command)) == name and command[name] == collection
+
+
+def _issued(api, method, url, name, collection, where=lambda command: True, **kwargs):
+    """The ``name`` commands on ``collection`` a request to the route sends"""
+    http, recorder = api
+    start = len(recorder.since())
+    response = http.request(method, url, **kwargs)
+    assert response.status_code == 200, response.text
+    commands = [c for c in recorder.since(start) if _targets(c, name, collection) and where(c)]
+    assert commands, f"{method} {url} sent no {name} to {collection}"
+    return commands
+
+
+def _explain(db, command):
+    command = {key: value for key, value in command.items() if key not in NOT_EXPLAINED}
+    return db.command("explain", command, verbosity="executionStats")
+
+
+def _assert_index_scan(explain, index_name, max_examined=None):
+    stages = _stages(_find("winningPlan", explain))
+    assert "COLLSCAN" not in stages, stages
+    if not (index_name == "_id_" and ID_LOOKUP_STAGES & set(stages)):
+        assert "IXSCAN" in stages, stages
+        assert index_name in str(_find("winningPlan", explain))
+
+    stats = _find("executionStats", explain)
+    examined, returned = stats["totalDocsExamined"], stats["nReturned"]
+    bound = max_examined if max_examined is not None else max(1, returned) * MAX_DOCS_RATIO
+    assert examined <= bound, f"examined {examined} docs for {returned} results"
+    return stats
+
+
+def test_register_email_lookup(seeded, api):
+    db, data = seeded
+    user = data["users"][3]
+    [command] = _issued(api, "POST", "/api/register", "find", "users",
+                        json={"name": user["name"], "email": user["email"]})
+    stats = _assert_index_scan(_explain(db, command), "email_1")
+    assert stats["nReturned"] == 1
+
+
+def test_get_user_by_id(seeded, api):
+    db, data = seeded
+    [command] = _issued(api, "GET", f"/api/user/{data['users'][5]['id']}", "find", "users")
+    _assert_index_scan(_explain(db, command), "_id_")
+
+
+def test_donations_feed(seeded, api):
+    db, _ = seeded
+    [command] = _issued(api, "GET", "/api/donations?limit=100", "find", "donations",
+                        where=lambda c: c["filter"] == {"status": "completed"})
+    explain = _explain(db, command)
+    stats = _assert_index_scan(explain, "status_1_timestamp_-1")
+    assert stats["nReturned"] == 100
+    assert "SORT" not in _stages(_find("winningPlan", explain))
+
+
+def test_user_timeline(seeded, api):
+    db, data = seeded
+    [command] = _issued(api, "GET", f"/api/user/{data['users'][0]['id']}/timeline", "find", "donations",
+                        where=lambda c: "user_id" in c["filter"])
+    explain = _explain(db, command)
+    _assert_index_scan(explain, "user_id_1_status_1_timestamp_-1")
+    assert "SORT" not in _stages(_find("winningPlan", explain))
+
+
+def test_timeline_charity_lookup(seeded, api):
+    db, data = seeded
+    # Charities are cached at startup; a cold cache makes the route look them up
+    api[0].app.state.charity_cache.clear()
+    [command] = _issued(api, "GET", f"/api/user/{data['users'][1]['id']}/timeline", "find", "charities")
+    _assert_index_scan(_explain(db, command), "_id_")
+
+
+def test_leaderboard_pipeline(seeded, api):
+    db, data = seeded
+    [command] = _issued(api, "GET", "/api/leaderboard", "aggregate", "donations")
+    completed = sum(1 for d in data["donations"] if d["status"] == "completed")
+    # The $match must not touch pending/failed donations
+    _assert_index_scan(_explain(db, command), "status_1_timestamp_-1", max_examined=completed)
+
+
+def test_leaderboard_user_lookups(seeded, api):
+    db, _ = seeded
+    for command in _issued(api, "GET", "/api/leaderboard", "find", "users"):
+        _assert_index_scan(_explain(db, command), "_id_")
+
+
+def test_verify_donation_update(seeded, api):
+    db, data = seeded
+    donation = next(d for d in data["donations"] if d["status"] == "pending")
+    [command] = _issued(api, "POST", "/api/payment/verify", "update", "donations",
+                        where=lambda c: "status" in c["updates"][0]["q"],
+                        json={"donation_id": donation["id"], "payment_id": f"pay-{uuid.uuid4()}"})
+    _assert_index_scan(_explain(db, command), "_id_")
+
+
+def test_replay_lookup_by_txn_id(seeded, api):
+    db, data = seeded
+    donation = data["donations"][9]
+    db.donations.update_one(ids.id_filter(donation["id"]), {"$set": {"txn_id": "pay-replay"}})
+    # Verified by another instance: only this instance's Bloom filter knows of it
+    api[0].app.state.replay_guard.bloom.add("pay-replay")
+    [command] = _issued(api, "POST", "/api/payment/verify", "find", "donations",
+                        where=lambda c: "txn_id" in c["filter"], json={"donation_id": donation["id"], "payment_id": "pay-replay"})
+    stats = _assert_index_scan(_explain(db, command), "txn_id_1")
+    assert stats["nReturned"] == 1
+
+
+def test_replay_filter_load_is_covered(seeded, api):
+    db, _ = seeded
+    # Issued once, by the lifespan
+    [command] = [c for c in api[1].since() if _targets(c, "find", "donations")
+                 and c["filter"] == {"txn_id": {"$type": "string"}}]
+    stats = _assert_index_scan(_explain(db, command), "txn_id_1")
+    assert stats["totalDocsExamined"] == 0
+
+
+def test_audio_lookup(seeded, api):
+    db, data = seeded
+    [command] = _issued(api, "GET", f"/api/audio-message/{data['donations'][10]['id']}", "find", "audio_messages")
+    _assert_index_scan(_explain(db, command), "donation_id_1_duration_1")
+
+
+def test_audio_presence_lookup_is_covered(seeded, api):
+    db, data = seeded
+    donation_ids = [d["id"] for d in data["donations"][:100]]
+    [command] = _issued(api, "POST", "/api/audio-message/lookup", "find", "audio_messages",
+                        json={"donation_ids": donation_ids})
+    stats = _assert_index_scan(_explain(db, command), "donation_id_1_duration_1")
+    # Served from the index alone, so no audio blob is ever loaded
+    assert stats["totalDocsExamined"] == 0
+
+
+def test_outbox_claim(seeded, api):
+    db, data = seeded
+
+    def claims():
+        return [c for c in api[1].since() if any(_targets(c, name, "donations") for name in CLAIM_COMMANDS)
+                and "outbox.state" in str(c.get("query", c.get("filter", c.get("updates"))))]
+
+    # The worker claims the seeded outbox records on its own
+    deadline = time.monotonic() + 10
+    while not claims() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert claims(), "the outbox worker sent no claim"
+    # The sparse index only holds donations with an outbox record
+    queued = sum(1 for d in data["donations"] if "outbox" in d)
+    for command in claims():
+        # The lease update only touches the candidates the claim's find picked, by _id
+        leasing = "_id" in str(command.get("updates"))
+        _assert_index_scan(_explain(db, command), "_id_" if leasing else "outbox_state_1_available_at_1",
+                           max_examined=queued)
@@ -0,0 +1,178 @@
+"""Read routing tests.
+
+The replica-set tests need a local three-member replica set, e.g.::
+
+    for port in 27017 27018 27019; do
+        mongod --replSet rs0 --port $port --dbpath /tmp/rs0-$port --fork --logpath /tmp/rs0-$port.log
+    done
+    mongosh --port 27017 --eval 'rs.initiate({_id: "rs0", members: [
+        {_id: 0, host: "localhost:27017"}, {_id: 1, host: "localhost:27018"},
+        {_id: 2, host: "localhost:27019"}]})'
+
+and READ_ROUTING_RS_URL=mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0
+"""
+import asyncio
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+bson = pytest.importorskip("bson")
+
+from pymongo.read_preferences import Primary, SecondaryPreferred
+
+from routing import causal_session, decode_causal_token, encode_causal_token, secondary_database
+from tests.fakes import FakeClient, FakeSession
+
+RS_URL = os.getenv("READ_ROUTING_RS_URL")
+FEED_REQUESTS = int(os.getenv("READ_ROUTING_FEED_REQUESTS", "200"))
+
+
+def test_secondary_database_applies_staleness_bound():
+    db = pymongo.MongoClient(connect=False)["routing_test"]
+    routed = secondary_database(db, 120)
+    assert isinstance(routed.read_preference, SecondaryPreferred)
+    assert routed.read_preference.max_staleness == 120
+    # The drivers reject bounds under 90 seconds
+    assert secondary_database(db, 10).read_preference.max_staleness == 90
+    assert isinstance(secondary_database(db, 0).read_preference, Primary)
+
+
+KEY = b"test-causal-key"
+
+
+def _session(operation_time=bson.Timestamp(1700000000, 3),
+             cluster_time={"clusterTime": bson.Timestamp(1700000000, 4), "signature": {"keyId": 0}}):
+    return SimpleNamespace(operation_time=operation_time, cluster_time=cluster_time)
+
+
+def test_causal_token_round_trip():
+    session = _session()
+    decoded = decode_causal_token(encode_causal_token(session, KEY), KEY)
+    assert decoded["operationTime"] == session.operation_time
+    assert decoded["clusterTime"] == session.cluster_time
+
+
+def test_no_token_without_cluster_time_and_bad_tokens_are_ignored():
+    assert encode_causal_token(SimpleNamespace(operation_time=None, cluster_time=None), KEY) is None
+    assert decode_causal_token(None, KEY) is None
+    assert decode_causal_token("not a token", KEY) is None
+    assert decode_causal_token("e30=", KEY) is None  # valid base64, not a BSON token
+    assert decode_causal_token("e30=.é", KEY) is None  # non-ASCII signature
+
+
+def test_unsigned_and_forged_tokens_are_ignored():
+    token = encode_causal_token(_session(), KEY)
+    payload, signature = token.split(".")
+    assert decode_causal_token(payload, KEY) is None
+    assert decode_causal_token(token, b"another instance") is None
+
+    # A far-future operationTime would otherwise be sent to the server as afterClusterTime
+    forged = encode_causal_token(_session(operation_time=bson.Timestamp(4000000000, 1)), b"guessed")
+    assert decode_causal_token(f"{forged.split('.')[0]}.{signature}", KEY) is None
+
+
+@pytest.mark.parametrize("cluster_time", [{}, {"clusterTime": 1700000000}, {"clusterTime": None}])
+def test_signed_tokens_without_a_cluster_timestamp_are_ignored(cluster_time):
+    token = encode_causal_token(_session(cluster_time=cluster_time), KEY)
+    assert decode_causal_token(token, KEY) is None
+
+
+def test_causal_session_falls_back_to_a_plain_read_when_the_driver_rejects_the_token():
+    class RejectingSession(FakeSession):
+        def advance_cluster_time(self, cluster_time):
+            raise ValueError("Invalid cluster_time")
+
+    class Client:
+        async def start_session(self, **kwargs):
+            return RejectingSession()
+
+    async def read():
+        async with causal_session(Client(), encode_causal_token(_session(), KEY), KEY) as session:
+            return session
+
+    assert isinstance(asyncio.run(read()), RejectingSession)
+
+
+def test_timeline_ignores_a_malformed_causal_token():
+    fastapi_testclient = pytest.importorskip("fastapi.testclient")
+    import server
+
+    client = FakeClient()
+    app = server.create_app(server.Settings(mongo_url="mongodb://fake", db_name="fake", causal_token_secret="s"))
+    app.state.client = client
+    app.state.db = app.state.secondary_db = client.db
+    app.state.charity_cache = {}
+    malformed = encode_causal_token(_session(cluster_time={}), b"s")
+
+    response = fastapi_testclient.TestClient(app).get("/api/user/u1/timeline", headers={"X-Causal-Token": malformed})
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def _opcounters(member_url):
+    client = pymongo.MongoClient(member_url, directConnection=True)
+    try:
+        counters = client.admin.command("serverStatus")["opcounters"]
+        return counters["query"] + counters["command"]
+    finally:
+        client.close()
+
+
+@pytest.fixture(scope="module")
+def replica_set_app():
+    if not RS_URL:
+        pytest.skip("set READ_ROUTING_RS_URL to a local three-member replica set")
+    fastapi_testclient = pytest.importorskip("fastapi.testclient")
+    import server
+
+    client = pymongo.MongoClient(RS_URL, serverSelectionTimeoutMS=2000)
+    hello = client.admin.command("hello")
+    members = {"primary": hello["primary"], "secondaries": hello.get("hosts", [])}
+    members["secondaries"] = [host for host in members["secondaries"] if host != hello["primary"]]
+    if len(members["secondaries"]) < 2:
+        pytest.skip("replica set needs two secondaries")
+
+    db_name = f"hopeorb_routing_{uuid.uuid4().hex[:8]}"
+    settings = server.Settings(mongo_url=RS_URL, db_name=db_name, outbox_workers=1)
+    with fastapi_testclient.TestClient(server.create_app(settings)) as api:
+        yield api, members
+    client.drop_database(db_name)
+    client.close()
+
+
+def test_feed_reads_are_offloaded_to_secondaries(replica_set_app):
+    api, members = replica_set_app
+    api.post("/api/init-charities")
+
+    before = {host: _opcounters(f"mongodb://{host}") for host in [members["primary"], *members["secondaries"]]}
+    for _ in range(FEED_REQUESTS):
+        assert api.get("/api/donations?limit=20").status_code == 200
+    after = {host: _opcounters(f"mongodb://{host}") for host in before}
+
+    primary_ops = after[members["primary"]] - before[members["primary"]]
+    secondary_ops = sum(after[host] - before[host] for host in members["secondaries"])
+    offload = secondary_ops / max(1, primary_ops + secondary_ops)
+    print(f"primary offload: {offload:.0%} ({secondary_ops} secondary / {primary_ops} primary ops)")
+    # Heartbeats and monitoring also hit every member, so leave some slack
+    assert secondary_ops >= FEED_REQUESTS
+    assert offload > 0.5
+
+
+def test_donor_sees_own_fresh_donation_with_causal_token(replica_set_app):
+    api, _ = replica_set_app
+    user = api.post("/api/register", json={"name": "Causal Donor", "email": f"{uuid.uuid4().hex}@example.com"}).json()
+    charity_id = api.get("/api/charities").json()[0]["id"]
+    donation = api.post("/api/donations", json={"user_id": user["id"], "charity_id": charity_id, "amount": 40}).json()
+
+    verified = api.post("/api/payment/verify", json={"donation_id": donation["id"], "payment_id": str(uuid.uuid4())})
+    token = verified.headers["X-Causal-Token"]
+
+    started = time.perf_counter()
+    timeline = api.get(f"/api/user/{user['id']}/timeline", headers={"X-Causal-Token": token}).json()
+    assert [item["donation_id"] for item in timeline] == [donation["id"]]
+    print(f"causal timeline read took {(time.perf_counter() - started) * 1000:.1f} ms")
@@ -0,0 +1,33 @@
+from replay import BloomFilter, ReplayGuard
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=5000, error_rate=0.01)
+    items = [f"pay-{i}" for i in range(5000)]
+    for item in items:
+        bloom.add(item)
+    assert all(item in bloom for item in items)
+
+
+def test_bloom_filter_false_positive_rate_near_target():
+    bloom = BloomFilter(capacity=5000, error_rate=0.01)
+    for i in range(5000):
+        bloom.add(f"pay-{i}")
+    false_positives = sum(f"other-{i}" in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.02
+
+
+def test_guard_remembers_recent_payments_exactly():
+    guard = ReplayGuard(capacity=100, recent_size=2)
+    assert not guard.might_be_replay("p1")
+
+    guard.remember("p1", "d1")
+    guard.remember("p2", "d2")
+    assert guard.verified_donation("p1") == "d1"
+
+    # p2 is now the least recently used entry and is evicted first
+    guard.remember("p3", "d3")
+    assert guard.verified_donation("p2") is None
+    assert guard.verified_donation("p1") == "d1"
+    # Evicted payments stay in the Bloom filter, so they still get a DB check
+    assert guard.might_be_replay("p2")
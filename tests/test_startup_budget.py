@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("motor")
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+# Budget for a cold `import server` in a fresh interpreter (autoscaled pods)
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+DEFERRED_MODULES = ["pandas", "pyarrow", "httpx"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import server
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({
+    "elapsed_ms": elapsed_ms,
+    "loaded": [m for m in %r if m in sys.modules],
+    "has_state_db": hasattr(server.app.state, "db"),
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def _import_server():
+    # No MONGO_URL/DB_NAME: importing must not need a live configuration
+    env = {"PATH": os.environ.get("PATH", ""), "PYTHONDONTWRITEBYTECODE": "1"}
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_needs_no_configuration_and_opens_nothing():
+    probe = _import_server()
+    assert probe["has_state_db"] is False
+
+
+def test_heavy_optional_imports_are_deferred():
+    assert _import_server()["loaded"] == []
+
+
+def test_import_time_within_budget():
+    # Best of three to keep filesystem cache noise out of the measurement
+    elapsed = min(_import_server()["elapsed_ms"] for _ in range(3))
+    assert elapsed < IMPORT_BUDGET_MS, f"import server took {elapsed:.0f} ms"
+
+
+def test_failed_startup_stops_the_worker_and_closes_the_client(monkeypatch, tmp_path):
+    import asyncio
+
+    import server
+    from tests.fakes import FakeClient
+
+    client = FakeClient()
+    monkeypatch.setattr(server, "AsyncIOMotorClient", lambda *args, **kwargs: client)
+
+    async def unreachable_bank(self):
+        raise OSError("bank unreachable")
+
+    monkeypatch.setattr(server.BankClient, "start", unreachable_bank)
+    app = server.create_app(server.Settings(
+        mongo_url="mongodb://fake", db_name="fake", archive_dir=tmp_path / "archive",
+        bank_url="http://bank.invalid",
+    ))
+
+    async def start():
+        async with server.lifespan(app):
+            pass
+
+    with pytest.raises(OSError):
+        asyncio.run(start())
+    assert client.closed
+    assert app.state.outbox_worker._tasks == []